@@ -1,7 +1,51 @@
+import argparse
+import json
 import os
+import re
 import subprocess
 import sys
-import winreg
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import winreg
+except ImportError:
+    # 非 Windows 平台只能使用批量部署模式（--fleet），注册表相关功能不可用
+    winreg = None
+
+# 默认安装的常用库
+DEFAULT_PACKAGES = ['numpy', 'scipy', 'matplotlib', 'pandas', 'seaborn', 'markdown', 'beautifulsoup4']
+
+# 发行包名与导入名不一致的库
+IMPORT_NAMES = {
+    'beautifulsoup4': 'bs4',
+}
+
+# 导入验证结果缓存（按解释器 + 包版本记录）
+VERIFY_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".pyenvsetup", "verify_cache.json")
+
+# 默认 pip 源（清华镜像）
+DEFAULT_INDEX_URL = 'https://pypi.tuna.tsinghua.edu.cn/simple'
+
+# 批量部署模式的共享下载缓存
+FLEET_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pyenvsetup", "cache")
+
+# 批量部署默认的最大并行目标数（未指定 --jobs 时所有目标同时部署，但不超过该值）
+MAX_FLEET_JOBS = 64
+
+# 目标为目录时（venv 前缀或 chroot 根目录），依次查找其中的解释器
+TARGET_PYTHON_CANDIDATES = [
+    "python.exe",
+    os.path.join("Scripts", "python.exe"),
+    os.path.join("bin", "python3"),
+    os.path.join("bin", "python"),
+    os.path.join("usr", "local", "bin", "python3"),
+    os.path.join("usr", "bin", "python3"),
+]
+
+# -X importtime 输出格式：import time: <self us> | <cumulative us> | <缩进><模块名>
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)\s*$")
 
 def normalize_path(path):
     """
@@ -114,25 +158,365 @@ def change_pip_source_custom(source_url=None):
     try:
         if source_url is None:
             # 默认使用清华镜像
-            source_url = 'https://pypi.tuna.tsinghua.edu.cn/simple'
+            source_url = DEFAULT_INDEX_URL
         subprocess.run([sys.executable, '-m', 'pip', 'config', 'set', 'global.index-url', source_url], check=True)
         print(f"pip 源设置成功：使用 {source_url}")
     except subprocess.CalledProcessError:
         print("pip 源设置失败，请检查权限或网络连接")
         
 
-def install_packages():
-    """批量安装常用库"""
-    packages = ['numpy', 'scipy', 'matplotlib', 'pandas', 'seaborn', 'markdown', 'beautifulsoup4']
+def install_packages(packages=None):
+    """批量安装常用库，返回安装成功的包列表"""
+    if packages is None:
+        packages = DEFAULT_PACKAGES
+    installed = []
     for i, package in enumerate(packages, start=1):
         print(f"[{i}/{len(packages)}] 正在安装 {package}...")
         try:
             subprocess.run([sys.executable, '-m', 'pip', 'install', package], check=True)
             print(f"{package} 安装成功")
+            installed.append(package)
         except subprocess.CalledProcessError:
             print(f"{package} 安装失败，请检查网络或包名")
+    return installed
 
-if __name__ == "__main__":
+def load_verify_cache(cache_file=VERIFY_CACHE_FILE):
+    """读取导入验证缓存，文件不存在或损坏时返回空缓存"""
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_verify_cache(cache, cache_file=VERIFY_CACHE_FILE):
+    """写入导入验证缓存（先写临时文件再替换，避免中断导致缓存损坏）"""
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"写入验证缓存失败：{e}")
+
+def query_package_versions(packages, python=None):
+    """在目标解释器中一次性查询各发行包的版本，未安装的包版本为 None"""
+    python = python or sys.executable
+    script = (
+        "import json, sys\n"
+        "from importlib import metadata\n"
+        "versions = {}\n"
+        "for name in sys.argv[1:]:\n"
+        "    try:\n"
+        "        versions[name] = metadata.version(name)\n"
+        "    except metadata.PackageNotFoundError:\n"
+        "        versions[name] = None\n"
+        "print(json.dumps(versions))\n"
+    )
+    result = subprocess.run([python, '-c', script] + list(packages),
+                            capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"退出码 {result.returncode}")
+    return json.loads(result.stdout)
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 [(模块名, 自身耗时us, 累计耗时us, 嵌套层级), ...]"""
+    records = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            records.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return records
+
+def get_startup_modules(python=None):
+    """获取解释器启动阶段（site 等）已导入的模块，统计时予以排除"""
+    python = python or sys.executable
+    result = subprocess.run([python, '-X', 'importtime', '-c', 'pass'],
+                            capture_output=True, text=True, timeout=60)
+    return {module for module, _, _, _ in parse_importtime(result.stderr)}
+
+def smoke_test_import(package, python=None, startup_modules=(), timeout=120):
+    """在独立子进程中导入包，并记录各模块的导入耗时"""
+    python = python or sys.executable
+    module_name = IMPORT_NAMES.get(package, package)
+    try:
+        result = subprocess.run([python, '-X', 'importtime', '-c', f'import {module_name}'],
+                                capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"ok": False, "error": f"导入超时（>{timeout} 秒）", "total_us": 0, "modules": []}
+
+    records = [r for r in parse_importtime(result.stderr) if r[0] not in startup_modules]
+    # 顶层模块的累计耗时即为整个包的导入耗时
+    total_us = next((cumulative for module, _, cumulative, level in records
+                     if module == module_name and level == 0), 0)
+    modules = sorted(([module, self_us, cumulative] for module, self_us, cumulative, _ in records),
+                     key=lambda m: m[1], reverse=True)
+
+    if result.returncode != 0:
+        # 只保留 traceback 的最后一行作为错误摘要
+        errors = [line for line in result.stderr.splitlines()
+                  if line.strip() and not line.startswith("import time:")]
+        error = errors[-1] if errors else f"退出码 {result.returncode}"
+        return {"ok": False, "error": error, "total_us": total_us, "modules": modules}
+    return {"ok": True, "error": None, "total_us": total_us, "modules": modules}
+
+def verify_packages(packages=None, python=None, workers=None, top=15, use_cache=True):
+    """并行验证已安装的包能否正常导入，并输出按导入耗时排序的报告"""
+    if packages is None:
+        packages = DEFAULT_PACKAGES
+    python = python or sys.executable
+    workers = workers or min(8, os.cpu_count() or 1)
+
+    print(f"\n正在验证 {len(packages)} 个包的导入情况（{workers} 个并行进程）...")
+    try:
+        versions = query_package_versions(packages, python)
+        startup_modules = get_startup_modules(python)
+    except (OSError, RuntimeError, ValueError, subprocess.TimeoutExpired) as e:
+        print(f"无法在 {python} 中执行验证：{e}")
+        return {}
+
+    cache = load_verify_cache() if use_cache else {}
+    cache_key = normalize_path(python)
+    cached_results = cache.get(cache_key, {})
+
+    results = {}
+    pending = []
+    for package in packages:
+        version = versions.get(package)
+        cached = cached_results.get(package)
+        if version is None:
+            results[package] = {"version": None, "ok": False, "error": "未安装",
+                                "total_us": 0, "modules": [], "cached": False}
+        elif cached and cached.get("ok") and cached.get("version") == version:
+            # 版本未变化且上次验证通过，直接复用结果
+            results[package] = dict(cached, cached=True)
+        else:
+            pending.append(package)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(smoke_test_import, package, python, startup_modules): package
+                   for package in pending}
+        for future in as_completed(futures):
+            package = futures[future]
+            result = future.result()
+            result["version"] = versions.get(package)
+            result["cached"] = False
+            results[package] = result
+            status = "✓" if result["ok"] else "✗"
+            print(f"  {status} {package} ({result['total_us'] / 1000:.1f} ms)")
+
+    if use_cache:
+        cached_results.update({package: {k: v for k, v in result.items() if k != "cached"}
+                               for package, result in results.items() if result["version"]})
+        cache[cache_key] = cached_results
+        save_verify_cache(cache)
+
+    print_verify_report(results, top)
+    return results
+
+def print_verify_report(results, top=15):
+    """打印导入验证报告：各包耗时排名与最慢的模块"""
+    print("\n导入验证报告（按导入耗时降序）：")
+    ranked = sorted(results.items(), key=lambda item: item[1]["total_us"], reverse=True)
+    for package, result in ranked:
+        version = result["version"] or "-"
+        note = "（缓存）" if result.get("cached") else ""
+        if result["ok"]:
+            print(f"  ✓ {package:<16} {version:<12} {result['total_us'] / 1000:>9.1f} ms{note}")
+        else:
+            print(f"  ✗ {package:<16} {version:<12} 导入失败：{result['error']}")
+
+    # 同一模块可能被多个包导入，取其中最大的自身耗时
+    module_costs = {}
+    for package, result in results.items():
+        for module, self_us, cumulative_us in result["modules"]:
+            if self_us > module_costs.get(module, (0, 0, ""))[0]:
+                module_costs[module] = (self_us, cumulative_us, package)
+    if module_costs:
+        print(f"\n自身导入耗时最高的 {top} 个模块：")
+        slowest = sorted(module_costs.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        for module, (self_us, cumulative_us, package) in slowest:
+            print(f"  {self_us / 1000:>9.1f} ms  (累计 {cumulative_us / 1000:>9.1f} ms)  {module}  [{package}]")
+
+    failed = [package for package, result in results.items() if not result["ok"]]
+    if failed:
+        print(f"\n以下包导入失败，建议重新安装：{', '.join(failed)}")
+    else:
+        print("\n所有包均可正常导入")
+
+def load_fleet_targets(targets_file):
+    """读取目标列表文件：每行一个解释器路径、venv 前缀或 chroot 根目录，# 开头为注释"""
+    targets = []
+    with open(targets_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                targets.append(line)
+    return targets
+
+def resolve_target_python(target):
+    """将目标解析为解释器路径"""
+    if os.path.isfile(target):
+        return os.path.abspath(target)
+    if os.path.isdir(target):
+        for candidate in TARGET_PYTHON_CANDIDATES:
+            python = os.path.join(target, candidate)
+            if os.path.isfile(python):
+                return os.path.abspath(python)
+    raise FileNotFoundError(f"未在 {target} 中找到 Python 解释器")
+
+def build_target_env(python):
+    """为目标解释器构造子进程环境：将其所在目录及 Scripts 目录放到 PATH 最前面"""
+    python_dir = os.path.dirname(python)
+    paths_to_add = [python_dir, os.path.join(python_dir, "Scripts")]
+    env = os.environ.copy()
+    current_paths = [p for p in env.get("PATH", "").split(os.pathsep) if p.strip()]
+    normalized = [normalize_path(p) for p in current_paths]
+    new_paths = [p for p in paths_to_add if os.path.isdir(p) and normalize_path(p) not in normalized]
+    env["PATH"] = os.pathsep.join(new_paths + current_paths)
+    # 避免控制端的 venv / PYTHONPATH 泄漏到目标环境
+    env.pop("VIRTUAL_ENV", None)
+    env.pop("PYTHONPATH", None)
+    return env
+
+def run_logged(cmd, log, env=None, retries=0, timeout=1800):
+    """执行命令并将输出写入目标日志，失败时按指数退避重试"""
+    for attempt in range(retries + 1):
+        log.write(f"\n$ {' '.join(cmd)}\n")
+        log.flush()
+        try:
+            result = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, env=env, timeout=timeout)
+            if result.returncode == 0:
+                return True
+            log.write(f"命令失败，退出码 {result.returncode}\n")
+        except (OSError, subprocess.TimeoutExpired) as e:
+            log.write(f"命令执行异常：{e}\n")
+        if attempt < retries:
+            delay = 2 ** attempt
+            log.write(f"{delay} 秒后重试（{attempt + 1}/{retries}）...\n")
+            log.flush()
+            time.sleep(delay)
+    return False
+
+class WheelCache:
+    """批量部署共享的 wheel 缓存：相同解释器版本与平台的目标只下载一次"""
+
+    def __init__(self, cache_dir, packages, index_url=None, retries=0):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.packages = packages
+        self.index_url = index_url
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._tag_locks = {}
+        self._results = {}
+
+    def get_tag(self, python, env):
+        """获取解释器的 wheel 兼容标签，如 cp312-win_amd64"""
+        script = ("import sys, sysconfig; "
+                  "print(f'cp{sys.version_info[0]}{sys.version_info[1]}-' + sysconfig.get_platform())")
+        result = subprocess.run([python, '-c', script], capture_output=True, text=True, env=env, timeout=60)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f"退出码 {result.returncode}")
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", result.stdout.strip())
+
+    def ensure(self, tag, python, env, log):
+        """确保该标签的 wheel 已下载到本地，返回 wheelhouse 目录；下载失败返回 None"""
+        with self._lock:
+            tag_lock = self._tag_locks.setdefault(tag, threading.Lock())
+        # 同一标签只由第一个目标下载，其余目标等待并复用结果
+        with tag_lock:
+            if tag not in self._results:
+                wheelhouse = os.path.join(self.cache_dir, "wheels", tag)
+                os.makedirs(wheelhouse, exist_ok=True)
+                cmd = [python, '-m', 'pip', 'download', '--dest', wheelhouse,
+                       '--cache-dir', os.path.join(self.cache_dir, "pip")] + list(self.packages)
+                if self.index_url:
+                    cmd[4:4] = ['--index-url', self.index_url]
+                log.write(f"\n[下载] 为 {tag} 下载共享 wheel 缓存\n")
+                ok = run_logged(cmd, log, env=env, retries=self.retries)
+                self._results[tag] = wheelhouse if ok else None
+            else:
+                log.write(f"\n[下载] 复用 {tag} 的共享 wheel 缓存\n")
+        return self._results[tag]
+
+def provision_target(target, log_path, wheel_cache, index_url=None, retries=0):
+    """对单个目标执行 PATH、pip 源与安装步骤，返回 (是否成功, 说明)"""
+    with open(log_path, "w", encoding="utf-8") as log:
+        try:
+            python = resolve_target_python(target)
+            log.write(f"目标：{target}\n解释器：{python}\n")
+
+            # 1. PATH：只作用于该目标的子进程环境，不修改注册表
+            env = build_target_env(python)
+            log.write(f"\n[PATH] {env['PATH']}\n")
+
+            # 2. pip 源：写入目标环境自身的 site 配置，互不干扰
+            if index_url:
+                log.write("\n[pip 源]\n")
+                if not run_logged([python, '-m', 'pip', 'config', '--site', 'set', 'global.index-url', index_url],
+                                  log, env=env, retries=retries):
+                    return False, "pip 源设置失败"
+
+            # 3. 安装：优先从共享缓存离线安装，缓存不可用时回退到在线安装
+            tag = wheel_cache.get_tag(python, env)
+            wheelhouse = wheel_cache.ensure(tag, python, env, log)
+            log.write("\n[安装]\n")
+            install_cmd = [python, '-m', 'pip', 'install', '--cache-dir', os.path.join(wheel_cache.cache_dir, "pip")]
+            if wheelhouse and run_logged(install_cmd + ['--no-index', '--find-links', wheelhouse] + list(wheel_cache.packages),
+                                         log, env=env):
+                return True, f"安装完成（{tag}，共享缓存）"
+            if index_url:
+                install_cmd += ['--index-url', index_url]
+            if run_logged(install_cmd + list(wheel_cache.packages), log, env=env, retries=retries):
+                return True, f"安装完成（{tag}，在线安装）"
+            return False, "安装失败"
+        except Exception as e:
+            log.write(f"\n部署失败：{e}\n")
+            return False, str(e)
+
+def provision_fleet(targets, packages=None, jobs=None, retries=2, index_url=None,
+                    cache_dir=FLEET_CACHE_DIR, log_dir="fleet_logs"):
+    """并发部署多个目标环境，每个目标单独记录日志，返回 {目标: (是否成功, 说明, 耗时)}
+
+    jobs 为 None 时所有目标同时部署（不超过 MAX_FLEET_JOBS）
+    """
+    if packages is None:
+        packages = DEFAULT_PACKAGES
+    if jobs is None:
+        jobs = min(len(targets), MAX_FLEET_JOBS)
+    os.makedirs(log_dir, exist_ok=True)
+    wheel_cache = WheelCache(cache_dir, packages, index_url=index_url, retries=retries)
+
+    print(f"开始批量部署 {len(targets)} 个目标（最多 {jobs} 个并行），日志目录：{log_dir}")
+    start = time.monotonic()
+    results = {}
+
+    def run(index, target):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", target.strip("\\/"))[-60:] or "target"
+        log_path = os.path.join(log_dir, f"{index:03d}-{name}.log")
+        target_start = time.monotonic()
+        ok, message = provision_target(target, log_path, wheel_cache, index_url, retries)
+        return ok, message, time.monotonic() - target_start, log_path
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {executor.submit(run, i, target): target for i, target in enumerate(targets, start=1)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            target = futures[future]
+            ok, message, elapsed, log_path = future.result()
+            results[target] = (ok, message, elapsed)
+            status = "✓" if ok else "✗"
+            print(f"[{done}/{len(targets)}] {status} {target}：{message}（{elapsed:.1f} 秒）")
+            if not ok:
+                print(f"    详见日志：{log_path}")
+
+    failed = [target for target, (ok, _, _) in results.items() if not ok]
+    print(f"\n批量部署完成：成功 {len(targets) - len(failed)} 个，失败 {len(failed)} 个，"
+          f"总耗时 {time.monotonic() - start:.1f} 秒")
+    return results
+
+def interactive_setup():
+    """交互式配置当前解释器：PATH、pip 源、常用库安装与导入验证"""
     python_dir = os.path.dirname(sys.executable)
     scripts_dir = os.path.join(python_dir, "Scripts")
     # 如果需要 launcher_dir，可以在此定义，但需保证该目录存在
@@ -186,4 +570,35 @@ if __name__ == "__main__":
         else:
             print("无效选择，请输入 1, 2 或 3")
 
-    install_packages()
+    # 只验证本次安装成功的包，安装失败的包已在上面报告过
+    installed = install_packages()
+    if installed:
+        verify_packages(installed)
+
+def main():
+    """命令行入口：默认进入交互式配置，指定 --fleet 时批量部署"""
+    parser = argparse.ArgumentParser(description="Python 环境配置工具")
+    parser.add_argument("--fleet", metavar="TARGETS_FILE",
+                        help="批量部署模式：目标列表文件，每行一个解释器路径、venv 前缀或 chroot 根目录")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help=f"最大并行目标数（默认与目标数相同，最多 {MAX_FLEET_JOBS}）")
+    parser.add_argument("--retries", type=int, default=2, help="失败步骤的重试次数（默认 2）")
+    parser.add_argument("--mirror", default=DEFAULT_INDEX_URL,
+                        help="pip 源 URL（默认清华镜像，传入 none 保持目标原有配置）")
+    parser.add_argument("--cache-dir", default=FLEET_CACHE_DIR, help="共享下载缓存目录")
+    parser.add_argument("--log-dir", default="fleet_logs", help="各目标日志的输出目录")
+    args = parser.parse_args()
+
+    if args.fleet:
+        index_url = None if args.mirror.lower() == "none" else args.mirror
+        results = provision_fleet(load_fleet_targets(args.fleet), jobs=args.jobs, retries=args.retries,
+                                  index_url=index_url, cache_dir=args.cache_dir, log_dir=args.log_dir)
+        sys.exit(0 if all(ok for ok, _, _ in results.values()) else 1)
+
+    if winreg is None:
+        print("交互式配置仅支持 Windows，其他平台请使用 --fleet 批量部署模式")
+        sys.exit(1)
+    interactive_setup()
+
+if __name__ == "__main__":
+    main()
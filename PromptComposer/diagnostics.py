@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行诊断
+界面卡顿时用于定位原因，记录写入 JSON Lines 文件，可直接附在问题反馈中：
+- 事件循环延迟：以固定间隔的 after() 心跳测量实际到达时间与预期的差值
+- 处理函数耗时：包装界面事件处理函数，记录每次调用的耗时及嵌套关系
+- 内存：使用 tracemalloc 统计每个操作的内存增量与峰值；较慢的操作及抽样的操作额外对比快照，记录分配最多的代码位置
+- 悬浮窗：可选的置顶小窗口，实时显示以上数据
+"""
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+from functools import wraps
+from tkinter import Toplevel, Label, LEFT
+
+# 心跳间隔（毫秒）
+HEARTBEAT_INTERVAL_MS = 100
+
+# 事件循环延迟超过该值（毫秒）时记录一条卡顿事件
+LAG_THRESHOLD_MS = 200
+
+# 每个操作记录的内存分配位置数量
+TOP_ALLOCATORS = 5
+
+# 上次耗时超过该值（毫秒）的操作，下次调用时对比内存快照
+SLOW_OP_MS = 50
+
+# 其余操作每调用该次数抽样对比一次内存快照
+SNAPSHOT_SAMPLE_INTERVAL = 20
+
+# 悬浮窗刷新间隔（心跳次数）
+OVERLAY_REFRESH_BEATS = 5
+
+# 悬浮窗中显示的最近操作数量
+OVERLAY_RECENT_OPS = 8
+
+
+def default_output_path(base_dir):
+    """默认的诊断记录文件路径：base_dir/diagnostics-时间戳.jsonl"""
+    return os.path.join(base_dir, f"diagnostics-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl")
+
+
+class Diagnostics:
+    """Tk 界面运行诊断"""
+
+    def __init__(self, root, output_path, trace_memory=True):
+        self.root = root
+        self.output_path = output_path
+        self.trace_memory = trace_memory
+        self._file = open(output_path, "a", encoding="utf-8")
+        self._expected = None
+        self._beats = 0
+        # 正在执行的操作名称（支持嵌套）
+        self._stack = []
+        # 最近一次完成的最外层操作，用于归因卡顿
+        self._last_op = None
+        self._recent = deque(maxlen=OVERLAY_RECENT_OPS)
+        # 上次耗时超过 SLOW_OP_MS 的操作名称
+        self._slow_ops = set()
+        # 自上次心跳以来拍摄内存快照所用的时间（秒），不计入事件循环延迟
+        self._overhead = 0.0
+        # 操作名称 -> [次数, 总耗时, 最大耗时]
+        self.op_stats = {}
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.lag_events = 0
+        self._overlay = None
+        self._overlay_label = None
+
+    # ---------- 记录 ----------
+
+    def _write(self, event):
+        """写入一条 JSON 记录（立即刷新，程序崩溃时也不会丢失）"""
+        event["t"] = round(time.time(), 3)
+        self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def start(self):
+        """开始记录：启动内存跟踪与事件循环心跳"""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._write({
+            "type": "start",
+            "pid": os.getpid(),
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "trace_memory": self.trace_memory,
+        })
+        self._expected = time.perf_counter() + HEARTBEAT_INTERVAL_MS / 1000
+        self.root.after(HEARTBEAT_INTERVAL_MS, self._heartbeat)
+
+    def close(self):
+        """写入汇总信息并结束记录"""
+        if self._file.closed:
+            return
+        summary = {
+            "type": "summary",
+            "ops": {name: {"count": count, "total_ms": round(total, 2), "max_ms": round(maximum, 2)}
+                    for name, (count, total, maximum) in self.op_stats.items()},
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "lag_events": self.lag_events,
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            summary["memory_kb"] = current // 1024
+            summary["memory_peak_kb"] = peak // 1024
+            tracemalloc.stop()
+        self._write(summary)
+        self._file.close()
+
+    # ---------- 事件循环延迟 ----------
+
+    def _heartbeat(self):
+        """心跳：实际到达时间晚于预期的部分即为事件循环被阻塞的时间"""
+        now = time.perf_counter()
+        lag_ms = max(0.0, (now - self._expected - self._overhead) * 1000)
+        self._overhead = 0.0
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        if lag_ms >= LAG_THRESHOLD_MS:
+            self.lag_events += 1
+            self._write({"type": "lag", "ms": round(lag_ms, 2), "after": self._last_op})
+        self.last_lag_ms = lag_ms
+
+        self._beats += 1
+        if self._overlay is not None and self._beats % OVERLAY_REFRESH_BEATS == 0:
+            self._refresh_overlay()
+
+        self._expected = time.perf_counter() + HEARTBEAT_INTERVAL_MS / 1000
+        self.root.after(HEARTBEAT_INTERVAL_MS, self._heartbeat)
+
+    # ---------- 处理函数计时 ----------
+
+    def wrap(self, name, func):
+        """包装处理函数：记录耗时；最外层操作额外记录内存增量，较慢或抽样的操作再对比快照"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            outermost = not self._stack
+            memory_before = None
+            snapshot = None
+            if outermost and tracemalloc.is_tracing():
+                if self._should_snapshot(name):
+                    snapshot = self._take_snapshot()
+                tracemalloc.reset_peak()
+                memory_before = tracemalloc.get_traced_memory()[0]
+            parent = self._stack[-1] if self._stack else None
+            self._stack.append(name)
+            error = None
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                error = repr(e)
+                raise
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                self._stack.pop()
+                self._record_op(name, parent, elapsed_ms, error, memory_before, snapshot)
+        return wrapper
+
+    def _should_snapshot(self, name):
+        """上次较慢的操作，或每 SNAPSHOT_SAMPLE_INTERVAL 次调用抽样一次"""
+        count = self.op_stats.get(name, (0,))[0]
+        return name in self._slow_ops or count % SNAPSHOT_SAMPLE_INTERVAL == 0
+
+    def _take_snapshot(self):
+        """拍摄内存快照，所用时间记为诊断开销"""
+        start = time.perf_counter()
+        snapshot = tracemalloc.take_snapshot()
+        self._overhead += time.perf_counter() - start
+        return snapshot
+
+    def instrument(self, obj, names):
+        """将对象上的若干方法替换为计时版本；需在按钮等控件绑定这些方法之前调用"""
+        for name in names:
+            setattr(obj, name, self.wrap(name, getattr(obj, name)))
+
+    def _record_op(self, name, parent, elapsed_ms, error, memory_before, snapshot):
+        stats = self.op_stats.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed_ms
+        stats[2] = max(stats[2], elapsed_ms)
+
+        event = {"type": "op", "name": name, "ms": round(elapsed_ms, 2)}
+        if parent:
+            event["parent"] = parent
+        if error:
+            event["error"] = error
+        if memory_before is not None:
+            event.update(self._memory_report(memory_before, snapshot))
+        self._write(event)
+
+        if parent is None:
+            self._last_op = name
+            self._recent.append((name, elapsed_ms))
+            if elapsed_ms >= SLOW_OP_MS:
+                self._slow_ops.add(name)
+            else:
+                self._slow_ops.discard(name)
+
+    def _memory_report(self, memory_before, before):
+        """操作前后的内存增量与峰值；有操作前的快照时再对比快照，找出分配最多的代码位置"""
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            "memory_kb": current // 1024,
+            "memory_peak_kb": peak // 1024,
+            "memory_diff_kb": round((current - memory_before) / 1024, 1),
+        }
+        if before is None:
+            return report
+        start = time.perf_counter()
+        exclude = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        after = tracemalloc.take_snapshot().filter_traces(exclude)
+        diff = after.compare_to(before.filter_traces(exclude), "lineno")
+        report["top_allocators"] = [{"where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                                     "size_kb": round(stat.size_diff / 1024, 1),
+                                     "count": stat.count_diff}
+                                    for stat in diff[:TOP_ALLOCATORS] if stat.size_diff]
+        self._overhead += time.perf_counter() - start
+        return report
+
+    # ---------- 悬浮窗 ----------
+
+    def toggle_overlay(self, event=None):
+        """显示或关闭悬浮窗"""
+        if self._overlay is not None:
+            self._overlay.destroy()
+            self._overlay = None
+            return
+        self._overlay = Toplevel(self.root)
+        self._overlay.title("诊断")
+        self._overlay.attributes("-topmost", True)
+        self._overlay.protocol("WM_DELETE_WINDOW", self.toggle_overlay)
+        self._overlay_label = Label(self._overlay, font=("Consolas", 9), justify=LEFT, anchor="nw")
+        self._overlay_label.pack(fill="both", expand=True, padx=8, pady=8)
+        self._refresh_overlay()
+
+    def _refresh_overlay(self):
+        lines = [f"事件循环延迟: {self.last_lag_ms:7.1f} ms  (最大 {self.max_lag_ms:.1f} ms)",
+                 f"卡顿次数:     {self.lag_events}"]
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(f"内存:         {current / 1048576:7.1f} MB  (峰值 {peak / 1048576:.1f} MB)")
+        lines.append("")
+        lines.append("最近操作:")
+        for name, elapsed_ms in reversed(self._recent):
+            lines.append(f"  {name:<24} {elapsed_ms:8.1f} ms")
+        lines.append("")
+        lines.append(f"记录文件: {self.output_path}")
+        self._overlay_label.config(text="\n".join(lines))
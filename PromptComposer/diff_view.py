@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板比较窗口
+左右两栏对齐显示两个模板的差异：
+- 内容相同的段折叠为一行，段内相同的长区间只保留上下文
+- 差异在后台线程中计算并按批生成显示行，界面线程只负责把每批行写入文本框，大模板也不会卡住界面
+"""
+
+import queue
+import threading
+
+from tkinter import Toplevel, Frame, Label, Text, Scrollbar
+from tkinter import BOTH, LEFT, RIGHT, TOP, BOTTOM, X, Y, HORIZONTAL, END, DISABLED, NORMAL
+
+from template_engine import FIELD_NAMES
+from template_diff import diff_words, GUI_DIFF_TIMEOUT
+
+# 每批写入的行数
+ROWS_PER_BATCH = 300
+
+# 相同区间保留的上下文行数
+CONTEXT_LINES = 3
+
+# 超过该长度的行不再计算词级差异
+WORD_DIFF_MAX_LINE = 2000
+
+# 后台线程最多提前生成的批数
+PREFETCH_BATCHES = 4
+
+# 检查后台结果的间隔（毫秒）
+POLL_INTERVAL_MS = 20
+
+# 段落状态说明
+STATUS_LABELS = {
+    "equal": "相同",
+    "changed": "有差异",
+    "added": "仅右侧",
+    "removed": "仅左侧",
+}
+
+
+def iter_rows(section_diffs):
+    """生成对齐后的显示行：(左侧文本, 左侧标记, 右侧文本, 右侧标记, 词级差异或 None)"""
+    for section in section_diffs:
+        title = f"# {FIELD_NAMES.get(section.field, section.field)}（{STATUS_LABELS[section.status]}）"
+        yield title, "header", title, "header", None
+        if section.status == "equal":
+            yield "…… 内容相同，已折叠 ……", "folded", "…… 内容相同，已折叠 ……", "folded", None
+            continue
+
+        # 行级差异在渲染到该段时才计算
+        lines_a, lines_b, opcodes = section.lines
+        for index, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+            if tag == "equal":
+                yield from _equal_rows(lines_a, i1, i2, j1, index == 0, index == len(opcodes) - 1)
+                continue
+            left = lines_a[i1:i2]
+            right = lines_b[j1:j2]
+            for k in range(max(len(left), len(right))):
+                left_line = left[k] if k < len(left) else None
+                right_line = right[k] if k < len(right) else None
+                spans = None
+                if left_line and right_line and max(len(left_line), len(right_line)) <= WORD_DIFF_MAX_LINE:
+                    spans = diff_words(left_line, right_line, GUI_DIFF_TIMEOUT)
+                yield (left_line or "", "removed" if left_line is not None else "filler",
+                       right_line or "", "added" if right_line is not None else "filler", spans)
+
+
+def _equal_rows(lines, i1, i2, j1, is_first, is_last):
+    """相同区间：只保留与差异相邻的上下文，中间折叠"""
+    head = 0 if is_first else CONTEXT_LINES
+    tail = 0 if is_last else CONTEXT_LINES
+    if i2 - i1 <= head + tail + 1:
+        for line in lines[i1:i2]:
+            yield line, "", line, "", None
+        return
+    for line in lines[i1:i1 + head]:
+        yield line, "", line, "", None
+    folded = f"…… 省略 {i2 - i1 - head - tail} 行相同内容 ……"
+    yield folded, "folded", folded, "folded", None
+    for line in lines[i2 - tail:i2]:
+        yield line, "", line, "", None
+
+
+class DiffView:
+    """左右对照的差异窗口；compute 在后台线程中调用，返回 [SectionDiff, ...]"""
+
+    def __init__(self, root, title, left_title, right_title, compute):
+        self.window = Toplevel(root)
+        self.window.title(title)
+        self.window.geometry("1100x650")
+        self.window.transient(root)
+
+        self._row_count = 0
+        self._batches = queue.Queue(maxsize=PREFETCH_BATCHES)
+        self._closed = False
+        self.window.bind("<Destroy>", self._on_destroy)
+
+        # 底部留给调用方放置按钮
+        self.button_frame = Frame(self.window)
+        self.button_frame.pack(side=BOTTOM, fill=X, padx=10, pady=(0, 10))
+
+        header = Frame(self.window)
+        header.pack(side=TOP, fill=X, padx=10, pady=(10, 5))
+        self.status_label = Label(header, text="正在比较……", font=("微软雅黑", 9), fg="#666666")
+        self.status_label.pack(side=RIGHT)
+
+        titles = Frame(self.window)
+        titles.pack(side=TOP, fill=X, padx=10)
+        Label(titles, text=left_title, font=("微软雅黑", 10, "bold"), anchor="w").pack(
+            side=LEFT, fill=X, expand=True)
+        Label(titles, text=right_title, font=("微软雅黑", 10, "bold"), anchor="w").pack(
+            side=LEFT, fill=X, expand=True)
+
+        panes = Frame(self.window)
+        panes.pack(fill=BOTH, expand=True, padx=10, pady=5)
+        self.scrollbar = Scrollbar(panes, command=self._scroll_both)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+        self.left_text = self._create_pane(panes)
+        self.right_text = self._create_pane(panes)
+        self.left_text.config(yscrollcommand=lambda first, last: self._sync_scroll(self.right_text, first, last))
+        self.right_text.config(yscrollcommand=lambda first, last: self._sync_scroll(self.left_text, first, last))
+
+        threading.Thread(target=self._produce, args=(compute,), daemon=True).start()
+        self.window.after(POLL_INTERVAL_MS, self._render_batch)
+
+    def _create_pane(self, parent):
+        frame = Frame(parent)
+        frame.pack(side=LEFT, fill=BOTH, expand=True)
+        xscrollbar = Scrollbar(frame, orient=HORIZONTAL)
+        xscrollbar.pack(side=BOTTOM, fill=X)
+        widget = Text(frame, font=("Consolas", 10), wrap="none", state=DISABLED, bg="#f9f9f9",
+                      xscrollcommand=xscrollbar.set)
+        widget.pack(side=LEFT, fill=BOTH, expand=True)
+        xscrollbar.config(command=widget.xview)
+
+        widget.tag_configure("header", background="#e8e8ff", font=("Consolas", 10, "bold"))
+        widget.tag_configure("folded", foreground="#999999")
+        widget.tag_configure("removed", background="#ffecec")
+        widget.tag_configure("added", background="#eaffea")
+        widget.tag_configure("filler", background="#f0f0f0")
+        widget.tag_configure("word_removed", background="#ffb6b6")
+        widget.tag_configure("word_added", background="#a6f3a6")
+        return widget
+
+    def _scroll_both(self, *args):
+        self.left_text.yview(*args)
+        self.right_text.yview(*args)
+
+    def _sync_scroll(self, other, first, last):
+        """两栏行数一致，按相同比例滚动即可对齐"""
+        self.scrollbar.set(first, last)
+        if other.yview()[0] != float(first):
+            other.yview_moveto(first)
+
+    def _on_destroy(self, event):
+        if event.widget is self.window:
+            self._closed = True
+
+    # ---------- 后台线程 ----------
+
+    def _produce(self, compute):
+        """计算差异并按批生成显示行（不访问任何 Tk 控件）"""
+        try:
+            section_diffs = compute()
+            changed = sum(1 for section in section_diffs if section.status != "equal")
+            if not self._put(("status", f"共 {len(section_diffs)} 段，{changed} 段不同")):
+                return
+            batch = []
+            for row in iter_rows(section_diffs):
+                batch.append(row)
+                if len(batch) >= ROWS_PER_BATCH:
+                    if not self._put(("rows", batch)):
+                        return
+                    batch = []
+            if batch and not self._put(("rows", batch)):
+                return
+            self._put(("done", None))
+        except Exception as e:
+            self._put(("error", f"比较失败：{e}"))
+
+    def _put(self, item):
+        """放入一批结果；窗口已关闭时返回 False，后台线程随即结束"""
+        while not self._closed:
+            try:
+                self._batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # ---------- 界面线程 ----------
+
+    def _render_batch(self):
+        """写入后台线程生成的一批行，尚未写完时安排下一次"""
+        if self._closed:
+            return
+        try:
+            kind, payload = self._batches.get_nowait()
+        except queue.Empty:
+            self.window.after(POLL_INTERVAL_MS, self._render_batch)
+            return
+
+        if kind == "status":
+            self.status_label.config(text=payload)
+        elif kind == "error":
+            self.status_label.config(text=payload, fg="#cc0000")
+            return
+        elif kind == "done":
+            return
+        else:
+            self._insert_batch(payload)
+        self.window.after(1, self._render_batch)
+
+    def _insert_batch(self, batch):
+        self._insert_rows(self.left_text, [(row[0], row[1], row[4] and row[4][0], "word_removed")
+                                           for row in batch])
+        self._insert_rows(self.right_text, [(row[2], row[3], row[4] and row[4][1], "word_added")
+                                            for row in batch])
+        self._row_count += len(batch)
+
+    def _insert_rows(self, widget, rows):
+        widget.config(state=NORMAL)
+        line_number = self._row_count + 1
+        for text, tag, spans, word_tag in rows:
+            widget.insert(END, text + "\n", tag or ())
+            for start, end in spans or ():
+                widget.tag_add(word_tag, f"{line_number}.{start}", f"{line_number}.{end}")
+            line_number += 1
+        widget.config(state=DISABLED)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+输入框编辑历史
+- 每个字段记录插入 / 删除操作（差量），而不是整段内容的快照
+- 切换模板、清空内容前保存会话快照：字段内容按哈希放入共享内容池，
+  相同内容只保留一份；快照同时带走各字段当时的操作记录
+- 所有记录共用一个内存上限，超出时从最早的记录开始淘汰
+"""
+
+import sys
+import hashlib
+from collections import deque
+
+# 默认内存上限（字节）
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# 操作类型
+INSERT = "insert"
+DELETE = "delete"
+
+
+def text_size(text):
+    """估算字符串占用的内存"""
+    return sys.getsizeof(text)
+
+
+def offset_index(index, text):
+    """计算在 Tk 索引 index 处插入 text 后的结束索引（"行.列" 格式）"""
+    line, column = (int(part) for part in index.split("."))
+    newlines = text.count("\n")
+    if newlines:
+        last_newline = text.rfind("\n")
+        return f"{line + newlines}.{len(text) - last_newline - 1}"
+    return f"{line}.{column + len(text)}"
+
+
+class EditOperation:
+    """单个编辑操作：在 index 处插入或删除了 text；joined 为 True 时与前一个操作一起撤销/重做"""
+
+    __slots__ = ("seq", "kind", "index", "text", "joined")
+
+    def __init__(self, seq, kind, index, text, joined=False):
+        self.seq = seq
+        self.kind = kind
+        self.index = index
+        self.text = text
+        self.joined = joined
+
+
+class SessionSnapshot:
+    """会话快照：各字段内容的哈希（None 表示显示占位符）与当时的操作记录"""
+
+    __slots__ = ("seq", "label", "hashes", "undo", "redo")
+
+    def __init__(self, seq, label, hashes, undo, redo):
+        self.seq = seq
+        self.label = label
+        self.hashes = hashes
+        self.undo = undo
+        self.redo = redo
+
+
+class EditHistory:
+    """多字段编辑历史"""
+
+    def __init__(self, fields, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.fields = list(fields)
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+        self._seq = 0
+        self._undo = {field: deque() for field in self.fields}
+        self._redo = {field: [] for field in self.fields}
+        self._snapshots = deque()
+        self._redo_snapshots = []
+        # 内容哈希 -> [文本, 引用计数]
+        self._blobs = {}
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    # ---------- 字段操作 ----------
+
+    def record(self, field, kind, index, text, joined=False):
+        """记录一次插入或删除（连续输入 / 连续退格会合并为一条记录）
+
+        joined 为 True 时与上一条记录作为一步撤销（如替换 = 删除 + 插入）
+        """
+        if not text or field not in self._undo:
+            return
+        self._clear_ops(self._redo[field])
+        self._redo[field] = []
+
+        undo = self._undo[field]
+        last = undo[-1] if undo else None
+        if last is not None and not joined and not last.joined and last.kind == kind \
+                and "\n" not in text and "\n" not in last.text:
+            if kind == INSERT and offset_index(last.index, last.text) == index:
+                # 连续输入
+                self._merge(last, last.text + text)
+                return
+            if kind == DELETE and last.index == index:
+                # 连续按 Delete 向后删除
+                self._merge(last, last.text + text)
+                return
+            if kind == DELETE and offset_index(index, text) == last.index:
+                # 连续按退格向前删除
+                last.index = index
+                self._merge(last, text + last.text)
+                return
+
+        operation = EditOperation(self._next_seq(), kind, index, text, joined and bool(undo))
+        undo.append(operation)
+        self.memory_used += text_size(text)
+        self._evict()
+
+    def _merge(self, operation, text):
+        self.memory_used += text_size(text) - text_size(operation.text)
+        operation.text = text
+        self._evict()
+
+    def undo(self, field):
+        """撤销字段的最近一步操作，返回需要依次执行的逆操作 [(类型, 索引, 文本), ...]，没有可撤销的记录时返回 None"""
+        undo = self._undo.get(field)
+        if not undo:
+            return None
+        actions = []
+        while undo:
+            operation = undo.pop()
+            self._redo[field].append(operation)
+            inverse = DELETE if operation.kind == INSERT else INSERT
+            actions.append((inverse, operation.index, operation.text))
+            if not operation.joined:
+                break
+        return actions
+
+    def redo(self, field):
+        """重做字段最近撤销的一步操作，返回需要依次执行的操作 [(类型, 索引, 文本), ...]"""
+        redo = self._redo.get(field)
+        if not redo:
+            return None
+        actions = []
+        while redo:
+            operation = redo.pop()
+            self._undo[field].append(operation)
+            actions.append((operation.kind, operation.index, operation.text))
+            if not redo or not redo[-1].joined:
+                break
+        return actions
+
+    def _clear_ops(self, operations):
+        for operation in operations:
+            self.memory_used -= text_size(operation.text)
+
+    # ---------- 会话快照 ----------
+
+    def _add_blob(self, text):
+        blob_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        blob = self._blobs.get(blob_hash)
+        if blob is None:
+            self._blobs[blob_hash] = [text, 1]
+            self.memory_used += text_size(text)
+        else:
+            blob[1] += 1
+        return blob_hash
+
+    def _release_blob(self, blob_hash):
+        blob = self._blobs[blob_hash]
+        blob[1] -= 1
+        if blob[1] == 0:
+            self.memory_used -= text_size(blob[0])
+            del self._blobs[blob_hash]
+
+    def _capture(self, values, label):
+        """将当前内容和各字段的操作记录打包为快照，当前操作记录随之清空"""
+        hashes = {field: None if values.get(field) is None else self._add_blob(values[field])
+                  for field in self.fields}
+        snapshot = SessionSnapshot(self._next_seq(), label, hashes, self._undo, self._redo)
+        self._undo = {field: deque() for field in self.fields}
+        self._redo = {field: [] for field in self.fields}
+        return snapshot
+
+    def _restore(self, snapshot):
+        """从快照恢复操作记录，返回 (标签, {字段: 内容或 None})"""
+        values = {field: None if blob_hash is None else self._blobs[blob_hash][0]
+                  for field, blob_hash in snapshot.hashes.items()}
+        for blob_hash in snapshot.hashes.values():
+            if blob_hash is not None:
+                self._release_blob(blob_hash)
+        for field in self.fields:
+            self._clear_ops(self._undo[field])
+            self._clear_ops(self._redo[field])
+        self._undo = snapshot.undo
+        self._redo = snapshot.redo
+        return snapshot.label, values
+
+    def _drop_snapshot(self, snapshot):
+        for blob_hash in snapshot.hashes.values():
+            if blob_hash is not None:
+                self._release_blob(blob_hash)
+        for field in self.fields:
+            self._clear_ops(snapshot.undo[field])
+            self._clear_ops(snapshot.redo[field])
+
+    def take_snapshot(self, values, label=None):
+        """在切换模板等整体替换前保存会话快照；values 为 {字段: 内容或 None（占位符）}"""
+        for snapshot in self._redo_snapshots:
+            self._drop_snapshot(snapshot)
+        self._redo_snapshots = []
+        self._snapshots.append(self._capture(values, label))
+        self._evict()
+
+    def can_undo_snapshot(self):
+        return bool(self._snapshots)
+
+    def can_redo_snapshot(self):
+        return bool(self._redo_snapshots)
+
+    def undo_snapshot(self, current_values, current_label=None):
+        """回到上一个会话快照，返回 (标签, {字段: 内容或 None})；没有快照时返回 None"""
+        if not self._snapshots:
+            return None
+        self._redo_snapshots.append(self._capture(current_values, current_label))
+        result = self._restore(self._snapshots.pop())
+        self._evict()
+        return result
+
+    def redo_snapshot(self, current_values, current_label=None):
+        """重做被撤销的会话切换"""
+        if not self._redo_snapshots:
+            return None
+        self._snapshots.append(self._capture(current_values, current_label))
+        result = self._restore(self._redo_snapshots.pop())
+        self._evict()
+        return result
+
+    # ---------- 内存控制 ----------
+
+    def _evict(self):
+        """超出内存上限时，从最早的记录开始淘汰"""
+        while self.memory_used > self.memory_limit:
+            candidates = [(undo[0].seq, undo) for undo in self._undo.values() if undo]
+            # 最新的快照始终保留（即使单个快照已超出上限），保证最近一次切换总能撤销
+            if len(self._snapshots) > 1:
+                candidates.append((self._snapshots[0].seq, self._snapshots))
+            if not candidates:
+                break
+            _, oldest = min(candidates, key=lambda candidate: candidate[0])
+            if oldest is self._snapshots:
+                self._drop_snapshot(self._snapshots.popleft())
+            else:
+                self.memory_used -= text_size(oldest.popleft().text)
+                # 同一步中的后续操作一并淘汰，避免只撤销半步
+                while oldest and oldest[0].joined:
+                    self.memory_used -= text_size(oldest.popleft().text)
+
+        # 仍然超出时，说明剩余的都是重做记录
+        if self.memory_used > self.memory_limit:
+            for field in self.fields:
+                self._clear_ops(self._redo[field])
+                self._redo[field] = []
+            for snapshot in self._redo_snapshots:
+                self._drop_snapshot(snapshot)
+            self._redo_snapshots = []
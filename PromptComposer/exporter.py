@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示词导出
+直接由各字段内容逐段生成输出，不经过预览框、也不先拼接出完整的提示词：
+- 格式：Markdown（与预览一致）、JSON 对话消息、纯文本
+- 目标：文件、标准输出，可选 gzip / zstd 压缩
+- 剪贴板：超出单次复制上限的内容按段交接
+"""
+
+import io
+import os
+import sys
+import gzip
+import json
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from template_engine import FIELD_ORDER, FIELD_NAMES
+
+# 单次写出的最大字符数，超大字段按该大小切片输出
+CHUNK_SIZE = 1024 * 1024
+
+# 单次复制到剪贴板的最大字符数，超出时分段复制
+CLIPBOARD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# gzip 压缩级别（兼顾速度与体积）
+GZIP_LEVEL = 6
+
+# 支持的导出格式
+FORMATS = ("markdown", "json", "text")
+
+# 文件扩展名 -> 导出格式
+FORMAT_EXTENSIONS = {
+    ".md": "markdown",
+    ".json": "json",
+    ".txt": "text",
+}
+
+# 文件扩展名 -> 压缩方式
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip",
+    ".zst": "zstd",
+}
+
+
+class ExportError(Exception):
+    """导出失败（格式或压缩方式不受支持等）"""
+
+
+def _field_contents(values, fields=FIELD_ORDER):
+    """按字段顺序返回非空字段 [(字段名, 内容), ...]"""
+    contents = []
+    for field_name in fields:
+        content = (values.get(field_name) or "").strip()
+        if content:
+            contents.append((field_name, content))
+    return contents
+
+
+def _slices(text):
+    """将长文本切片输出"""
+    for start in range(0, len(text), CHUNK_SIZE):
+        yield text[start:start + CHUNK_SIZE]
+
+
+def iter_markdown(values, fields=FIELD_ORDER):
+    """逐段生成 Markdown 提示词，拼接结果与 render_prompt 完全一致"""
+    for i, (field_name, content) in enumerate(_field_contents(values, fields)):
+        if i:
+            yield "\n\n"
+        yield f"# {FIELD_NAMES.get(field_name, field_name)}\n"
+        if field_name == "User Input":
+            yield "<user_input>\n"
+            yield from _slices(content)
+            yield "\n</user_input>"
+        else:
+            yield from _slices(content)
+
+
+def iter_text(values):
+    """逐段生成纯文本：以「角色：」等标签分隔各部分，不含 Markdown 标记"""
+    for i, (field_name, content) in enumerate(_field_contents(values)):
+        if i:
+            yield "\n\n"
+        yield f"{FIELD_NAMES.get(field_name, field_name)}：\n"
+        yield from _slices(content)
+
+
+def _json_string(pieces):
+    """将文本片段逐段转义为 JSON 字符串内容（逐字符转义，切片位置不影响结果）"""
+    for piece in pieces:
+        yield json.dumps(piece, ensure_ascii=False)[1:-1]
+
+
+def iter_json(values):
+    """逐段生成 JSON 对话消息：用户输入作为 user 消息，其余部分作为 system 消息"""
+    system_fields = [field_name for field_name in FIELD_ORDER if field_name != "User Input"]
+    user_input = (values.get("User Input") or "").strip()
+    has_system = bool(_field_contents(values, system_fields))
+
+    yield "["
+    if has_system:
+        yield '{"role": "system", "content": "'
+        yield from _json_string(iter_markdown(values, system_fields))
+        yield '"}'
+    if user_input:
+        if has_system:
+            yield ", "
+        yield '{"role": "user", "content": "'
+        yield from _json_string(_slices(user_input))
+        yield '"}'
+    yield "]\n"
+
+
+FORMAT_WRITERS = {
+    "markdown": iter_markdown,
+    "json": iter_json,
+    "text": iter_text,
+}
+
+
+def iter_export(values, fmt="markdown"):
+    """按指定格式逐段生成导出内容"""
+    try:
+        return FORMAT_WRITERS[fmt](values)
+    except KeyError:
+        raise ExportError(f"不支持的导出格式：{fmt}")
+
+
+def export_size(values, fmt="markdown"):
+    """计算导出内容的字符数（不生成完整文本）"""
+    return sum(len(piece) for piece in iter_export(values, fmt))
+
+
+def guess_options(path):
+    """根据文件扩展名推断 (导出格式, 压缩方式)，如 prompt.json.gz -> ("json", "gzip")"""
+    root, ext = os.path.splitext(path.lower())
+    compression = COMPRESSION_EXTENSIONS.get(ext)
+    if compression:
+        ext = os.path.splitext(root)[1]
+    return FORMAT_EXTENSIONS.get(ext, "markdown"), compression
+
+
+def _compressed_writer(raw, compression):
+    """在二进制输出流外包装压缩层"""
+    if compression is None:
+        return raw
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ExportError("zstd 压缩需要先安装 zstandard：pip install zstandard")
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    raise ExportError(f"不支持的压缩方式：{compression}")
+
+
+@contextmanager
+def open_output(path, compression=None):
+    """打开文本输出流；path 为 "-" 时写到标准输出
+
+    写文件时先写入临时文件，完成后再替换，导出中途失败不会留下不完整的文件或临时文件
+    """
+    if path == "-":
+        # 另行打开标准输出的文件描述符（关闭时不关闭描述符本身），任何情况下都可以关闭整条输出链
+        sys.stdout.flush()
+        tmp_path = None
+        raw = open(sys.stdout.fileno(), "wb", closefd=False)
+    else:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        raw = open(tmp_path, "wb")
+    stream = None
+    completed = False
+    try:
+        binary = _compressed_writer(raw, compression)
+        stream = io.TextIOWrapper(binary, encoding="utf-8", newline="")
+        yield stream
+        # 依次关闭文本层、压缩层（写出压缩尾部）与底层文件
+        stream.close()
+        raw.close()
+        if tmp_path:
+            os.replace(tmp_path, path)
+        completed = True
+    finally:
+        if not completed:
+            for f in (stream, raw):
+                if f is not None:
+                    try:
+                        f.close()
+                    except (OSError, ValueError):
+                        pass
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def export_prompt(values, path, fmt=None, compression=None):
+    """将提示词导出到文件或标准输出，返回写出的字符数；未指定格式和压缩方式时根据扩展名推断"""
+    guessed_fmt, guessed_compression = guess_options(path) if path != "-" else ("markdown", None)
+    fmt = fmt or guessed_fmt
+    compression = compression or guessed_compression
+
+    pieces = iter_export(values, fmt)
+    written = 0
+    with open_output(path, compression) as stream:
+        for piece in pieces:
+            stream.write(piece)
+            written += len(piece)
+    return written
+
+
+def iter_clipboard_chunks(values, fmt="markdown", limit=CLIPBOARD_CHUNK_SIZE):
+    """将导出内容切分为不超过 limit 个字符的若干段，尽量在换行处切分"""
+    buffer = []
+    size = 0
+    for piece in iter_export(values, fmt):
+        buffer.append(piece)
+        size += len(piece)
+        while size >= limit:
+            text = "".join(buffer)
+            # 在后半段找换行作为切分点，找不到时按上限硬切
+            cut = text.rfind("\n", limit // 2, limit)
+            cut = limit if cut < 0 else cut + 1
+            yield text[:cut]
+            buffer = [text[cut:]]
+            size = len(buffer[0])
+    if size:
+        yield "".join(buffer)
@@ -6,42 +6,70 @@
 """
 
 import os
-import re
 import sys
-import glob
-from tkinter import Tk, Frame, Label, Entry, Text, Button, messagebox, simpledialog, Scrollbar
+import json
+import argparse
+from contextlib import contextmanager
+from tkinter import Tk, Toplevel, Frame, Label, Entry, Text, Button, Listbox, messagebox, simpledialog, filedialog, Scrollbar
 from tkinter.ttk import Combobox, PanedWindow
 from tkinter import BOTH, LEFT, RIGHT, TOP, BOTTOM, X, Y, VERTICAL, HORIZONTAL, END, DISABLED, NORMAL
 
+from template_engine import (FIELD_ORDER, FIELD_NAMES, default_templates_dir, parse_template,
+                             render_prompt, sanitize_template_name, normalize_field_name)
+from template_history import TemplateHistory, content_hash
+from template_store import DirectoryStore, SQLiteTemplateStore, StoreConflictError
+from edit_history import EditHistory, DEFAULT_MEMORY_LIMIT, INSERT, DELETE, offset_index
+from template_diff import diff_templates, merge_templates, GUI_DIFF_TIMEOUT
+from diff_view import DiffView
+from exporter import (FORMATS, CLIPBOARD_CHUNK_SIZE, ExportError, iter_markdown, iter_clipboard_chunks, export_size,
+                      export_prompt, guess_options, open_output)
+from render_cache import RenderCache
+
+# 检查共享存储变更的间隔（毫秒）
+STORE_POLL_INTERVAL_MS = 2000
+
+# 界面渲染缓存的内存上限（字节）：只缓存加载模板时的预览，大模板的结果只写磁盘
+RENDER_CACHE_MEMORY_LIMIT = 8 * 1024 * 1024
+
+# 诊断模式下计时的处理函数（_fill_fields / _set_preview 对应输入框与预览框的写入）
+INSTRUMENTED_HANDLERS = [
+    "_on_focus_out", "_on_template_selected", "_save_template", "_copy_to_clipboard", "_export_prompt",
+    "_load_template", "update_preview", "_fill_fields", "_set_preview", "_show_compare", "_merge_template",
+    "_undo_session", "_redo_session", "_clear_all",
+]
+
 
 class PromptComposer:
     """提示词生成器主类"""
     
-    def __init__(self, root):
+    def __init__(self, root, templates_dir=None, store=None, undo_memory_limit=DEFAULT_MEMORY_LIMIT,
+                 use_render_cache=True, diagnostics=None):
         self.root = root
         self.root.title("PromptComposer")
         self.root.geometry("1000x700")
         
-        # 模板目录：始终使用程序所在目录
-        if getattr(sys, 'frozen', False):
-            # 打包后的 exe 环境：使用 exe 文件所在目录
-            exe_dir = os.path.dirname(sys.executable)
-            self.templates_dir = os.path.join(exe_dir, "templates")
-        else:
-            # 开发环境：使用脚本所在目录
-            self.templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+        # 模板目录：默认使用程序所在目录
+        self.templates_dir = templates_dir or default_templates_dir()
+        
+        # 模板存储：默认使用模板目录，也可以指定 SQLite 共享存储
+        self.store = store or DirectoryStore(self.templates_dir)
+        if isinstance(self.store, DirectoryStore):
+            self._ensure_templates_folder()
         
-        self._ensure_templates_folder()
+        # 模板历史版本库
+        self.history = TemplateHistory(self.store.history_dir)
+        
+        # 渲染结果缓存（关闭时只保留内存缓存）
+        self.render_cache = RenderCache(self.store.cache_dir if use_render_cache else None,
+                                        memory_limit=RENDER_CACHE_MEMORY_LIMIT)
+        
+        # 已加载模板的版本号，保存时用于冲突检测
+        self.loaded_versions = {}
+        # 已加载模板的内容哈希，合并时据此找回加载时的版本作为基准
+        self.loaded_hashes = {}
         
         # 字段名中英文映射
-        self.field_names = {
-            "Role": "角色",
-            "Context": "背景",
-            "Task": "任务",
-            "Examples": "示例",
-            "Constraints": "约束",
-            "User Input": "用户输入"
-        }
+        self.field_names = FIELD_NAMES
         
         # 占位符文本
         self.placeholders = {
@@ -58,9 +86,25 @@ class PromptComposer:
         # 占位符状态标记
         self.placeholder_active = {}
         
+        # 编辑历史（撤销/重做与会话快照）
+        self.edit_history = EditHistory(FIELD_ORDER, memory_limit=undo_memory_limit)
+        # 大于 0 时不记录编辑操作（占位符切换、程序填充内容等）
+        self._edit_suspend_depth = 0
+        # 当前加载的模板名称，作为会话快照的标签
+        self.current_template = None
+        
+        # 诊断模式：必须在创建控件之前替换处理函数，按钮和下拉框绑定的才是计时版本
+        self.diagnostics = diagnostics
+        if diagnostics is not None:
+            diagnostics.instrument(self, INSTRUMENTED_HANDLERS)
+            self.root.bind("<F12>", diagnostics.toggle_overlay)
+        
         self._create_widgets()
         self._load_templates()
         
+        # 定期检查其他用户对模板的修改
+        self.root.after(STORE_POLL_INTERVAL_MS, self._poll_store_changes)
+        
     def _ensure_templates_folder(self):
         """确保模板文件夹存在，并生成 demo.md"""
         try:
@@ -173,6 +217,20 @@ def process_data(data):
         # 保存按钮
         Button(toolbar, text="💾 保存为模板", command=self._save_template, 
                font=("微软雅黑", 9), cursor="hand2").pack(side=LEFT, padx=5)
+        
+        # 历史版本按钮
+        Button(toolbar, text="🕘 历史版本", command=self._show_history, 
+               font=("微软雅黑", 9), cursor="hand2").pack(side=LEFT, padx=5)
+        
+        # 比较/合并按钮
+        Button(toolbar, text="🔀 比较/合并", command=self._show_compare, 
+               font=("微软雅黑", 9), cursor="hand2").pack(side=LEFT, padx=5)
+        
+        # 撤销/重做模板切换按钮
+        Button(toolbar, text="↶ 撤销切换", command=self._undo_session, 
+               font=("微软雅黑", 9), cursor="hand2").pack(side=LEFT, padx=5)
+        Button(toolbar, text="↷ 重做切换", command=self._redo_session, 
+               font=("微软雅黑", 9), cursor="hand2").pack(side=LEFT, padx=5)
     
     def _create_input_area(self, parent):
         """创建左侧输入区"""
@@ -215,6 +273,12 @@ def process_data(data):
                          height=height if not expand else 10, yscrollcommand=scrollbar.set)
             widget.pack(side=LEFT, fill=BOTH, expand=True)
             scrollbar.config(command=widget.yview)
+            
+            # 记录编辑差量，支持撤销/重做
+            self._install_edit_recorder(field_name, widget)
+            widget.bind("<Control-z>", lambda e: self._undo_field(field_name))
+            widget.bind("<Control-y>", lambda e: self._redo_field(field_name))
+            widget.bind("<Control-Z>", lambda e: self._redo_field(field_name))
         else:
             # 单行输入框
             widget = Entry(frame, font=("微软雅黑", 10))
@@ -247,6 +311,10 @@ def process_data(data):
         Button(button_frame, text="🗑️ 清空内容", command=self._clear_all, 
                font=("微软雅黑", 9), cursor="hand2").pack(side=LEFT, padx=5)
         
+        # 导出按钮
+        Button(button_frame, text="📤 导出", command=self._export_prompt,
+               font=("微软雅黑", 9), cursor="hand2").pack(side=LEFT, padx=5)
+        
         # 复制按钮
         Button(button_frame, text="📋 复制到剪贴板", command=self._copy_to_clipboard,
                font=("微软雅黑", 9), cursor="hand2").pack(side=LEFT, padx=5)
@@ -265,13 +333,166 @@ def process_data(data):
         self.preview_text.pack(side=LEFT, fill=BOTH, expand=True)
         scrollbar.config(command=self.preview_text.yview)
     
+    def _install_edit_recorder(self, field_name, widget):
+        """拦截 Text 组件的 Tcl 命令，在 insert/delete 时记录编辑差量"""
+        original = widget._w + "_original"
+        self.root.tk.call("rename", widget._w, original)
+        self.root.tk.createcommand(widget._w, lambda *args: self._on_text_command(field_name, original, *args))
+    
+    def _clamp_index(self, original, index):
+        """将索引规范为 "行.列"，超出末尾的索引收敛到最后一个字符之后"""
+        tk = self.root.tk
+        index = str(tk.call(original, "index", index))
+        if tk.call(original, "compare", index, ">", "end-1c"):
+            index = str(tk.call(original, "index", "end-1c"))
+        return index
+    
+    def _on_text_command(self, field_name, original, command, *args):
+        """Text 组件命令代理：先执行原命令，再记录插入/删除的内容"""
+        tk = self.root.tk
+        if self._edit_suspend_depth or command not in ("insert", "delete", "replace"):
+            return tk.call(original, command, *args)
+        
+        if command == "insert":
+            index = self._clamp_index(original, args[0])
+            result = tk.call(original, command, *args)
+            # insert index chars ?tagList chars tagList ...?
+            self.edit_history.record(field_name, INSERT, index, "".join(args[1::2]))
+            return result
+        
+        if command == "delete" and len(args) > 2:
+            return self._delete_ranges(field_name, original, args)
+        
+        # delete index1 ?index2? / replace index1 index2 chars ?tagList ...?
+        start = self._clamp_index(original, args[0])
+        end = self._clamp_index(original, args[1] if len(args) > 1 else f"{start}+1c")
+        deleted = str(tk.call(original, "get", start, end))
+        result = tk.call(original, command, *args)
+        self.edit_history.record(field_name, DELETE, start, deleted)
+        if command == "replace":
+            # 替换 = 删除 + 插入，作为一步撤销
+            self.edit_history.record(field_name, INSERT, start, "".join(args[2::2]), joined=True)
+        return result
+    
+    def _delete_ranges(self, field_name, original, args):
+        """delete index1 index2 index3 ?index4 ...?：多个区间合并后从后往前逐个删除，记录为一步撤销"""
+        tk = self.root.tk
+        ranges = []
+        for i in range(0, len(args), 2):
+            start = self._clamp_index(original, args[i])
+            end = self._clamp_index(original, args[i + 1] if i + 1 < len(args) else f"{start}+1c")
+            if tk.call(original, "compare", start, "<", end):
+                ranges.append((start, end))
+        ranges.sort(key=lambda r: tuple(int(part) for part in r[0].split(".")))
+        
+        merged = []
+        for start, end in ranges:
+            if merged and tk.call(original, "compare", start, "<=", merged[-1][1]):
+                if tk.call(original, "compare", end, ">", merged[-1][1]):
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        
+        # 从后往前删除，前面区间的索引不受影响
+        for i, (start, end) in enumerate(reversed(merged)):
+            deleted = str(tk.call(original, "get", start, end))
+            tk.call(original, "delete", start, end)
+            self.edit_history.record(field_name, DELETE, start, deleted, joined=i > 0)
+        return ""
+    
+    @contextmanager
+    def _suspend_edit_recording(self):
+        """暂停记录编辑操作（程序自身修改输入框内容时使用）"""
+        self._edit_suspend_depth += 1
+        try:
+            yield
+        finally:
+            self._edit_suspend_depth -= 1
+    
+    def _apply_edit(self, field_name, action):
+        """执行撤销/重做返回的操作"""
+        kind, index, text = action
+        widget = self.inputs[field_name]
+        with self._suspend_edit_recording():
+            if kind == INSERT:
+                widget.insert(index, text)
+                cursor = offset_index(index, text)
+            else:
+                widget.delete(index, offset_index(index, text))
+                cursor = index
+        widget.mark_set("insert", cursor)
+        widget.see("insert")
+    
+    def _undo_field(self, field_name):
+        """撤销输入框的最近一次编辑"""
+        for action in self.edit_history.undo(field_name) or ():
+            self._apply_edit(field_name, action)
+        return "break"
+    
+    def _redo_field(self, field_name):
+        """重做输入框最近撤销的编辑"""
+        for action in self.edit_history.redo(field_name) or ():
+            self._apply_edit(field_name, action)
+        return "break"
+    
+    def _get_session_values(self):
+        """获取所有输入框的原始内容，显示占位符的字段为 None"""
+        values = {}
+        for field_name in FIELD_ORDER:
+            if self.placeholder_active.get(field_name, False):
+                values[field_name] = None
+            else:
+                values[field_name] = self.inputs[field_name].get("1.0", "end-1c")
+        return values
+    
+    def _take_session_snapshot(self):
+        """在整体替换输入框内容前保存会话快照"""
+        self.edit_history.take_snapshot(self._get_session_values(), self.current_template)
+    
+    def _apply_session_values(self, label, values):
+        """将会话快照中的内容恢复到输入框"""
+        with self._suspend_edit_recording():
+            for field_name, text in values.items():
+                widget = self.inputs[field_name]
+                widget.delete("1.0", END)
+                if text is None:
+                    self._show_placeholder(field_name)
+                else:
+                    widget.insert("1.0", text)
+                    widget.config(fg="black")
+                    self.placeholder_active[field_name] = False
+        
+        # 同步模板下拉菜单
+        self.current_template = label
+        options = list(self.template_combo["values"])
+        if label in options:
+            self.template_combo.current(options.index(label))
+        self.update_preview()
+    
+    def _undo_session(self):
+        """撤销最近一次模板切换/清空，恢复之前所有输入框的内容"""
+        result = self.edit_history.undo_snapshot(self._get_session_values(), self.current_template)
+        if result is None:
+            messagebox.showinfo("提示", "没有可撤销的模板切换")
+            return
+        self._apply_session_values(*result)
+    
+    def _redo_session(self):
+        """重做被撤销的模板切换/清空"""
+        result = self.edit_history.redo_snapshot(self._get_session_values(), self.current_template)
+        if result is None:
+            messagebox.showinfo("提示", "没有可重做的模板切换")
+            return
+        self._apply_session_values(*result)
+    
     def _show_placeholder(self, field_name):
         """显示占位符"""
         widget = self.inputs[field_name]
         placeholder = self.placeholders[field_name]
         
-        widget.delete("1.0", END)
-        widget.insert("1.0", placeholder)
+        with self._suspend_edit_recording():
+            widget.delete("1.0", END)
+            widget.insert("1.0", placeholder)
         widget.config(fg="gray")
         
         self.placeholder_active[field_name] = True
@@ -281,7 +502,8 @@ def process_data(data):
         widget = self.inputs[field_name]
         
         if self.placeholder_active[field_name]:
-            widget.delete("1.0", END)
+            with self._suspend_edit_recording():
+                widget.delete("1.0", END)
             widget.config(fg="black")
             self.placeholder_active[field_name] = False
     
@@ -314,57 +536,107 @@ def process_data(data):
         else:
             return widget.get("1.0", END).strip()
     
+    def _get_field_values(self):
+        """获取所有输入框的实际内容"""
+        return {field_name: self._get_field_value(field_name) for field_name in FIELD_ORDER}
+    
     def update_preview(self):
         """更新预览区域"""
-        sections = []
-        
-        for field_name in ["Role", "Context", "Task", "Examples", "Constraints", "User Input"]:
-            content = self._get_field_value(field_name)
-            
-            if content:
-                display_name = self.field_names.get(field_name, field_name)
-                if field_name == "User Input":
-                    # User Input 需要特殊处理，包裹 XML 标签
-                    sections.append(f"# {display_name}\n<user_input>\n{content}\n</user_input>")
-                else:
-                    sections.append(f"# {display_name}\n{content}")
-        
-        # 拼接所有非空部分
-        preview_content = "\n\n".join(sections)
-        
-        # 更新预览文本框
+        # 拼接所有非空部分（编辑中的内容每次都不同，直接渲染，不经过缓存）
+        self._set_preview(render_prompt(self._get_field_values()))
+    
+    def _set_preview(self, preview_content):
+        """更新预览文本框"""
         self.preview_text.config(state=NORMAL)
         self.preview_text.delete("1.0", END)
         self.preview_text.insert("1.0", preview_content)
         self.preview_text.config(state=DISABLED)
     
     def _copy_to_clipboard(self):
-        """复制到剪贴板"""
+        """复制到剪贴板（直接由输入框内容生成，超大内容分段复制）"""
         try:
-            content = self.preview_text.get("1.0", END).strip()
-            if not content:
+            values = self._get_field_values()
+            size = export_size(values)
+            if not size:
                 messagebox.showwarning("提示", "预览区域为空，无内容可复制")
                 return
             
+            if size > CLIPBOARD_CHUNK_SIZE:
+                self._copy_in_chunks(values, size)
+                return
+            
             self.root.clipboard_clear()
-            self.root.clipboard_append(content)
+            for piece in iter_markdown(values):
+                self.root.clipboard_append(piece)
             messagebox.showinfo("成功", "已复制到剪贴板！")
         except Exception as e:
             messagebox.showerror("错误", f"复制失败：{e}")
     
+    def _copy_in_chunks(self, values, size):
+        """超出剪贴板上限的内容分段复制：粘贴一段后再复制下一段"""
+        chunks = iter_clipboard_chunks(values)
+        copied = 0
+        part = 0
+        
+        dialog = Toplevel(self.root)
+        dialog.title("分段复制")
+        dialog.geometry("400x140")
+        dialog.transient(self.root)
+        
+        label = Label(dialog, font=("微软雅黑", 10), justify=LEFT)
+        label.pack(fill=BOTH, expand=True, padx=10, pady=10)
+        
+        def copy_next():
+            nonlocal copied, part
+            chunk = next(chunks, None)
+            if chunk is None:
+                dialog.destroy()
+                messagebox.showinfo("成功", "全部内容已复制完毕！")
+                return
+            self.root.clipboard_clear()
+            self.root.clipboard_append(chunk)
+            copied += len(chunk)
+            part += 1
+            label.config(text=f"内容过大，已分段复制。\n第 {part} 段已复制到剪贴板（{copied:,} / {size:,} 字符）\n"
+                              "粘贴后点击「复制下一段」继续")
+            if copied >= size:
+                next_button.config(text="完成")
+        
+        button_frame = Frame(dialog)
+        button_frame.pack(fill=X, padx=10, pady=(0, 10))
+        Button(button_frame, text="取消", command=dialog.destroy,
+               font=("微软雅黑", 9), cursor="hand2").pack(side=RIGHT, padx=5)
+        next_button = Button(button_frame, text="复制下一段", command=copy_next,
+                             font=("微软雅黑", 9), cursor="hand2")
+        next_button.pack(side=RIGHT, padx=5)
+        copy_next()
+    
+    def _export_prompt(self):
+        """导出提示词到文件，格式与压缩方式由扩展名决定"""
+        values = self._get_field_values()
+        if not any(values.values()):
+            messagebox.showwarning("提示", "当前内容为空，无内容可导出")
+            return
+        
+        name = self.current_template if self.current_template in self.loaded_versions else "prompt"
+        path = filedialog.asksaveasfilename(
+            parent=self.root, title="导出提示词", initialfile=f"{name}.md", defaultextension=".md",
+            filetypes=[("Markdown", "*.md"), ("JSON 对话消息", "*.json"), ("纯文本", "*.txt"),
+                       ("gzip 压缩", "*.gz"), ("zstd 压缩", "*.zst"), ("所有文件", "*.*")])
+        if not path:
+            return
+        
+        try:
+            written = export_prompt(values, path)
+            messagebox.showinfo("成功", f"已导出 {written:,} 字符：{path}")
+        except Exception as e:
+            messagebox.showerror("错误", f"导出失败：{e}")
+    
     def _load_templates(self):
         """加载所有模板"""
         try:
-            # 扫描模板文件
-            template_files = glob.glob(os.path.join(self.templates_dir, "*.md"))
-            template_names = [os.path.splitext(os.path.basename(f))[0] for f in template_files]
-            
-            # 按字母排序
-            template_names.sort()
-            
-            # 添加"清空/默认"选项
-            options = ["[ 清空/默认 ]"] + template_names
-            self.template_combo["values"] = options
+            # 获取模板列表（按字母排序）
+            template_names = self._refresh_template_list()
             
             # 默认选择第一个模板（如果有）
             if len(template_names) > 0:
@@ -375,44 +647,74 @@ def process_data(data):
         except Exception as e:
             messagebox.showerror("错误", f"加载模板列表失败：{e}")
     
+    def _refresh_template_list(self):
+        """刷新下拉菜单中的模板列表，保持当前选中项不变"""
+        selected = self.template_combo.get()
+        template_names = self.store.list_names()
+        
+        # 添加"清空/默认"选项
+        options = ["[ 清空/默认 ]"] + template_names
+        self.template_combo["values"] = options
+        if selected in options:
+            self.template_combo.current(options.index(selected))
+        return template_names
+    
+    def _poll_store_changes(self):
+        """检查存储中发生变化的模板，只在有变化时刷新列表"""
+        try:
+            changed = self.store.poll_changes()
+            if changed:
+                self._refresh_template_list()
+                current = self.template_combo.get()
+                if current in changed and current in self.loaded_versions:
+                    self.root.title(f"PromptComposer - 模板「{current}」已被其他用户更新")
+        except Exception as e:
+            print(f"⚠ 检查模板变更失败: {e}")
+        self.root.after(STORE_POLL_INTERVAL_MS, self._poll_store_changes)
+    
     def _on_template_selected(self, event):
         """模板选择事件"""
         selected = self.template_combo.get()
         
         if selected == "[ 清空/默认 ]":
             self._clear_all()
+            self.current_template = selected
         else:
             self._load_template(selected)
     
     def _load_template(self, template_name):
         """加载指定模板"""
         try:
-            template_path = os.path.join(self.templates_dir, f"{template_name}.md")
+            content, version = self.store.load(template_name)
+            self.loaded_versions[template_name] = version
+            template_hash = content_hash(content)
+            self.loaded_hashes[template_name] = template_hash
+            self.root.title("PromptComposer")
+            
+            # 保存切换前的会话快照，支持撤销切换
+            self._take_session_snapshot()
+            self.current_template = template_name
             
-            with open(template_path, "r", encoding="utf-8") as f:
-                content = f.read()
+            # 解析 Markdown 并填充到输入框
+            fields = parse_template(content)
+            self._fill_fields(fields)
             
-            # 使用正则表达式解析 Markdown
-            # 匹配格式：# 标题\n内容（直到下一个 # 或文件结束）
-            pattern = r'^# (.+?)\n(.*?)(?=^# |\Z)'
-            matches = re.findall(pattern, content, re.MULTILINE | re.DOTALL)
+            # 更新预览（按模板内容哈希缓存渲染结果，与批量渲染、渲染服务共用缓存条目）
+            self._set_preview(self.render_cache.render(fields, template_hash=template_hash))
             
+        except (FileNotFoundError, KeyError):
+            messagebox.showerror("错误", f"模板文件不存在：{template_name}.md")
+        except Exception as e:
+            messagebox.showerror("错误", f"加载模板失败：{e}")
+    
+    def _fill_fields(self, fields):
+        """清空所有输入框后填充解析得到的字段内容"""
+        with self._suspend_edit_recording():
             # 清空所有输入框
             self._clear_all_fields()
             
             # 填充内容
-            for title, text in matches:
-                title = title.strip()
-                text = text.strip()
-                
-                # 中文标题转换为英文字段名
-                chinese_to_field = {v: k for k, v in self.field_names.items()}
-                field_name = chinese_to_field.get(title, title)
-                
-                # 处理用户输入的特殊情况（移除 <user_input> 标签）
-                if field_name == "User Input" or title == "用户输入":
-                    text = re.sub(r'^<user_input>\s*|\s*</user_input>$', '', text, flags=re.MULTILINE).strip()
-                
+            for field_name, text in fields.items():
                 # 填充到对应输入框
                 if field_name in self.inputs:
                     widget = self.inputs[field_name]
@@ -421,14 +723,211 @@ def process_data(data):
                     widget.delete("1.0", END)
                     widget.insert("1.0", text)
                     widget.config(fg="black")
-            
-            # 更新预览
+    
+    def _write_template(self, name, template_content, expected_version=None):
+        """写入模板并记录历史版本；expected_version 与存储中不一致时抛出 StoreConflictError"""
+        # 首次覆盖已有模板时，先把旧内容记为历史基线
+        if self.store.exists(name) and not self.history.list_versions(name):
+            self._record_history(name, self.store.load(name)[0])
+        
+        self.loaded_versions[name] = self.store.save(name, template_content, expected_version)
+        self.loaded_hashes[name] = content_hash(template_content)
+        
+        self._record_history(name, template_content)
+    
+    def _record_history(self, name, template_content):
+        """记录历史版本（失败不影响模板保存）"""
+        try:
+            self.history.record(name, template_content)
+        except Exception as e:
+            print(f"⚠ 记录历史版本失败: {e}")
+    
+    def _show_history(self):
+        """显示当前模板的历史版本"""
+        name = self.template_combo.get()
+        if not name or name == "[ 清空/默认 ]":
+            messagebox.showwarning("提示", "请先选择一个模板")
+            return
+        
+        versions = list(reversed(self.history.list_versions(name)))
+        if not versions:
+            messagebox.showinfo("提示", f"模板「{name}」暂无历史版本")
+            return
+        
+        dialog = Toplevel(self.root)
+        dialog.title(f"历史版本 - {name}")
+        dialog.geometry("420x320")
+        dialog.transient(self.root)
+        
+        list_frame = Frame(dialog)
+        list_frame.pack(fill=BOTH, expand=True, padx=10, pady=10)
+        scrollbar = Scrollbar(list_frame)
+        scrollbar.pack(side=RIGHT, fill=Y)
+        listbox = Listbox(list_frame, font=("Consolas", 10), yscrollcommand=scrollbar.set)
+        listbox.pack(side=LEFT, fill=BOTH, expand=True)
+        scrollbar.config(command=listbox.yview)
+        
+        for version in versions:
+            listbox.insert(END, f"v{version['version']:<4} {version['time'].replace('T', ' ')}  {version['size']:,} 字符")
+        listbox.selection_set(0)
+        
+        def restore_selected():
+            selection = listbox.curselection()
+            if not selection:
+                return
+            version = versions[selection[0]]
+            try:
+                content = self.history.restore(name, version["version"])
+            except Exception as e:
+                messagebox.showerror("错误", f"恢复历史版本失败：{e}", parent=dialog)
+                return
+            self._take_session_snapshot()
+            self._fill_fields(parse_template(content))
             self.update_preview()
-            
-        except FileNotFoundError:
-            messagebox.showerror("错误", f"模板文件不存在：{template_name}.md")
+            dialog.destroy()
+        
+        button_frame = Frame(dialog)
+        button_frame.pack(fill=X, padx=10, pady=(0, 10))
+        Button(button_frame, text="关闭", command=dialog.destroy,
+               font=("微软雅黑", 9), cursor="hand2").pack(side=RIGHT, padx=5)
+        Button(button_frame, text="加载到编辑区", command=restore_selected,
+               font=("微软雅黑", 9), cursor="hand2").pack(side=RIGHT, padx=5)
+        listbox.bind("<Double-Button-1>", lambda e: restore_selected())
+    
+    def _compare_candidates(self, name):
+        """比较对象列表 [(显示名称, 标题, 读取函数), ...]：
+        当前模板的已保存版本与历史版本在前，其余模板在后
+
+        读取函数返回 (内容, 存储版本号)；只有当前模板的已保存版本带版本号，其余为 None
+        """
+        candidates = []
+        if name:
+            candidates.append((f"「{name}」已保存的版本", f"已保存的「{name}」",
+                               lambda: self.store.load(name)))
+            for version in reversed(self.history.list_versions(name)):
+                number = version["version"]
+                candidates.append((f"「{name}」 v{number}  {version['time'].replace('T', ' ')}",
+                                   f"「{name}」 v{number}",
+                                   lambda number=number: (self.history.restore(name, number), None)))
+        for candidate in self.store.list_names():
+            if candidate != name:
+                candidates.append((candidate, f"模板「{candidate}」",
+                                   lambda candidate=candidate: (self.store.load(candidate)[0], None)))
+        return candidates
+    
+    def _show_compare(self):
+        """选择一个模板（或当前模板的已保存版本、历史版本）与当前编辑内容进行比较"""
+        name = self.current_template if self.current_template in self.loaded_versions else None
+        candidates = self._compare_candidates(name)
+        if not candidates:
+            messagebox.showinfo("提示", "没有可比较的模板")
+            return
+        
+        dialog = Toplevel(self.root)
+        dialog.title("选择比较对象")
+        dialog.geometry("420x320")
+        dialog.transient(self.root)
+        
+        list_frame = Frame(dialog)
+        list_frame.pack(fill=BOTH, expand=True, padx=10, pady=10)
+        scrollbar = Scrollbar(list_frame)
+        scrollbar.pack(side=RIGHT, fill=Y)
+        listbox = Listbox(list_frame, font=("微软雅黑", 10), yscrollcommand=scrollbar.set)
+        listbox.pack(side=LEFT, fill=BOTH, expand=True)
+        scrollbar.config(command=listbox.yview)
+        
+        for label, _, _ in candidates:
+            listbox.insert(END, label)
+        listbox.selection_set(0)
+        
+        def compare_selected():
+            selection = listbox.curselection()
+            if not selection:
+                return
+            _, other_title, load = candidates[selection[0]]
+            try:
+                other_content, other_version = load()
+            except (FileNotFoundError, KeyError):
+                messagebox.showerror("错误", f"{other_title}不存在", parent=dialog)
+                return
+            except Exception as e:
+                messagebox.showerror("错误", f"读取比较对象失败：{e}", parent=dialog)
+                return
+            dialog.destroy()
+            self._open_diff_view(name, other_title, other_content, other_version)
+        
+        button_frame = Frame(dialog)
+        button_frame.pack(fill=X, padx=10, pady=(0, 10))
+        Button(button_frame, text="关闭", command=dialog.destroy,
+               font=("微软雅黑", 9), cursor="hand2").pack(side=RIGHT, padx=5)
+        Button(button_frame, text="比较", command=compare_selected,
+               font=("微软雅黑", 9), cursor="hand2").pack(side=RIGHT, padx=5)
+        listbox.bind("<Double-Button-1>", lambda e: compare_selected())
+    
+    def _open_diff_view(self, name, other_title, other_content, other_version=None):
+        """左右对照显示当前编辑内容与比较对象的差异；other_version 为比较对象是当前模板已保存版本时的版本号"""
+        ours_content = render_prompt(self._get_field_values())
+        left_title = f"当前编辑内容（{name}）" if name else "当前编辑内容"
+        view = DiffView(self.root, f"比较 - {name or '当前内容'} ↔ {other_title}", left_title, other_title,
+                        lambda: diff_templates(ours_content, other_content, GUI_DIFF_TIMEOUT))
+        
+        Button(view.button_frame, text="关闭", command=view.window.destroy,
+               font=("微软雅黑", 9), cursor="hand2").pack(side=RIGHT, padx=5)
+        Button(view.button_frame, text="合并到编辑区",
+               command=lambda: self._merge_template(view, name, other_title, ours_content, other_content,
+                                                    other_version),
+               font=("微软雅黑", 9), cursor="hand2").pack(side=RIGHT, padx=5)
+    
+    def _loaded_content(self, name):
+        """读取编辑区加载时的模板原文：存储中的版本未变时直接读取，否则按内容哈希在历史版本中查找"""
+        loaded_hash = self.loaded_hashes.get(name)
+        if loaded_hash is None:
+            return None
+        if self.store.version(name) == self.loaded_versions.get(name):
+            content, _ = self.store.load(name)
+            if content_hash(content) == loaded_hash:
+                return content
+        for version in reversed(self.history.list_versions(name)):
+            if version["hash"] == loaded_hash:
+                return self.history.restore(name, version["version"])
+        return None
+    
+    def _merge_template(self, view, name, other_title, ours_content, other_content, other_version=None):
+        """三方合并：以编辑区加载时的模板版本为基准，找不到时以空内容为基准
+
+        与当前模板的已保存版本合并后，编辑区视为基于该版本，之后保存时以该版本号检测新的修改
+        """
+        base_content = None
+        if name:
+            try:
+                base_content = self._loaded_content(name)
+            except Exception as e:
+                print(f"⚠ 读取加载时的版本失败: {e}")
+        
+        merged, conflicts = merge_templates(base_content, ours_content, other_content)
+        view.window.destroy()
+        if other_version is not None:
+            self.loaded_versions[name] = other_version
+            self.loaded_hashes[name] = content_hash(other_content)
+        
+        self._take_session_snapshot()
+        self._fill_fields(parse_template(merged))
+        self.update_preview()
+        
+        if conflicts:
+            messagebox.showwarning("合并冲突", f"有 {conflicts} 处冲突，已用 <<<<<<< / >>>>>>> 标出。\n"
+                                               "请在编辑区处理后再保存。")
+            return
+        if not name or not messagebox.askyesno("合并完成", f"已合并{other_title}的修改。\n是否保存到模板「{name}」？"):
+            return
+        
+        try:
+            self._write_template(name, render_prompt(self._get_field_values()), self.loaded_versions.get(name))
+            self.root.title("PromptComposer")
+        except StoreConflictError:
+            messagebox.showerror("保存冲突", f"模板「{name}」已被其他用户修改，请重新加载后再合并")
         except Exception as e:
-            messagebox.showerror("错误", f"加载模板失败：{e}")
+            messagebox.showerror("错误", f"保存模板失败：{e}")
     
     def _save_template(self):
         """保存当前内容为模板"""
@@ -439,36 +938,33 @@ def process_data(data):
             return
         
         # 过滤非法字符
-        name = re.sub(r'[\\/:*?"<>|]', '_', name)
+        name = sanitize_template_name(name)
         
         # 生成文件内容
-        sections = []
-        for field_name in ["Role", "Context", "Task", "Examples", "Constraints", "User Input"]:
-            content = self._get_field_value(field_name)
-            
-            if content:
-                display_name = self.field_names.get(field_name, field_name)
-                if field_name == "User Input":
-                    sections.append(f"# {display_name}\n<user_input>\n{content}\n</user_input>")
-                else:
-                    sections.append(f"# {display_name}\n{content}")
-        
-        template_content = "\n\n".join(sections)
+        template_content = render_prompt(self._get_field_values())
         
         if not template_content.strip():
             messagebox.showwarning("提示", "当前内容为空，无法保存模板")
             return
         
         try:
-            # 保存文件
-            template_path = os.path.join(self.templates_dir, f"{name}.md")
-            with open(template_path, "w", encoding="utf-8") as f:
-                f.write(template_content)
+            # 保存文件（基于加载时的版本号检测其他用户的修改；本次未加载过的模板按新建处理，期望版本为 0）
+            try:
+                self._write_template(name, template_content, self.loaded_versions.get(name, 0))
+            except StoreConflictError as e:
+                if e.expected_version == 0:
+                    message = f"模板「{name}」已存在（可能刚被其他用户创建）。\n是否覆盖？"
+                else:
+                    message = f"模板「{name}」已被其他用户修改。\n是否覆盖对方的修改？"
+                if not messagebox.askyesno("保存冲突", message):
+                    return
+                self._write_template(name, template_content)
             
             messagebox.showinfo("成功", f"模板已保存：{name}.md")
+            self.root.title("PromptComposer")
             
             # 刷新模板列表
-            self._load_templates()
+            self._refresh_template_list()
             
             # 自动选中新保存的模板
             template_names = list(self.template_combo["values"])
@@ -479,29 +975,182 @@ def process_data(data):
             messagebox.showerror("错误", f"保存模板失败：{e}")
     
     def _clear_all(self):
-        """清空所有内容"""
+        """清空所有内容（可通过“撤销切换”恢复）"""
+        self._take_session_snapshot()
         self._clear_all_fields()
         self.update_preview()
     
     def _clear_all_fields(self):
         """清空所有输入框并恢复占位符"""
-        for field_name in self.inputs:
-            widget = self.inputs[field_name]
-            
-            if isinstance(widget, Entry):
-                widget.delete(0, END)
-            else:
-                widget.delete("1.0", END)
-            
-            # 恢复占位符
-            self._show_placeholder(field_name)
+        with self._suspend_edit_recording():
+            for field_name in self.inputs:
+                widget = self.inputs[field_name]
+                
+                if isinstance(widget, Entry):
+                    widget.delete(0, END)
+                else:
+                    widget.delete("1.0", END)
+                
+                # 恢复占位符
+                self._show_placeholder(field_name)
+
+
+class BatchError(Exception):
+    """批量渲染的输入有误"""
+
+
+def parse_batch_item(line, line_number):
+    """解析批量输入的一行，返回覆盖字段 {字段名: 内容}"""
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise BatchError(f"第 {line_number} 行不是有效的 JSON：{e}")
+    if isinstance(item, str):
+        return {"User Input": item}
+    if not isinstance(item, dict):
+        raise BatchError(f"第 {line_number} 行必须是字段对象或用户输入字符串")
+    overrides = {}
+    for title, text in item.items():
+        if not isinstance(text, str):
+            raise BatchError(f"第 {line_number} 行：字段 {title} 的内容必须是字符串")
+        overrides[normalize_field_name(title)] = text
+    return overrides
+
+
+def run_batch(store, template_name, batch_path, output_path, cache):
+    """批量渲染：输入每行一个 JSON（字段覆盖对象，或作为用户输入的字符串），
+    结果按行写出 {"prompt": ...}，返回渲染条数；输出路径以 .gz/.zst 结尾时压缩
+    """
+    content, _ = store.load(template_name)
+    fields = parse_template(content)
+    template_hash = content_hash(content)
+    _, compression = guess_options(output_path)
+    
+    count = 0
+    source = sys.stdin if batch_path == "-" else open(batch_path, "r", encoding="utf-8")
+    try:
+        with open_output(output_path, compression) as stream:
+            for line_number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                overrides = parse_batch_item(line, line_number)
+                prompt = cache.render({**fields, **overrides}, template_hash=template_hash, overrides=overrides)
+                stream.write(json.dumps({"prompt": prompt}, ensure_ascii=False) + "\n")
+                count += 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return count
 
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="PromptComposer 结构化提示词生成工具")
+    parser.add_argument("--serve", action="store_true", help="以本地 HTTP 渲染服务方式运行（不启动界面）")
+    parser.add_argument("--host", default="127.0.0.1", help="渲染服务监听地址（默认 127.0.0.1）")
+    parser.add_argument("--port", type=int, default=8765, help="渲染服务监听端口（默认 8765）")
+    parser.add_argument("--templates", default=None, help="模板目录（默认程序所在目录下的 templates）")
+    parser.add_argument("--undo-limit", type=int, default=DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+                        help="撤销记录的内存上限（MB，默认 64）")
+    parser.add_argument("--store", default=None, help="使用 SQLite 共享存储（数据库文件路径），代替模板目录")
+    parser.add_argument("--import-dir", default=None, help="将 .md 模板目录导入 --store 指定的数据库后退出")
+    parser.add_argument("--export-dir", default=None, help="将 --store 指定的数据库导出为 .md 模板目录后退出")
+    parser.add_argument("--export", default=None, metavar="OUTPUT",
+                        help="将 --template 指定的模板生成提示词并导出后退出（- 表示标准输出，.gz/.zst 结尾自动压缩）")
+    parser.add_argument("--template", default=None, help="--export / --batch 使用的模板名称")
+    parser.add_argument("--batch", default=None, metavar="INPUTS",
+                        help="批量渲染 --template 指定的模板：每行一个 JSON（字段对象或用户输入字符串），"
+                             "结果按行输出到 --export（默认标准输出）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用磁盘渲染缓存")
+    parser.add_argument("--diagnostics", nargs="?", const="", default=None, metavar="PATH",
+                        help="诊断模式：记录事件循环延迟、处理函数耗时与内存分配（JSON Lines，默认写到程序目录），"
+                             "按 F12 显示悬浮窗")
+    parser.add_argument("--input", default=None, help="--export 时作为用户输入的文件（- 表示标准输入）")
+    parser.add_argument("--format", choices=FORMATS, default=None,
+                        help="--export 的输出格式（默认根据扩展名推断，标准输出默认 markdown）")
+    args = parser.parse_args()
+    
+    store = SQLiteTemplateStore(args.store) if args.store else None
+    if args.import_dir or args.export_dir:
+        if store is None:
+            parser.error("--import-dir / --export-dir 需要同时指定 --store")
+        if args.import_dir:
+            print(f"✓ 已导入 {store.import_directory(args.import_dir)} 个模板")
+        if args.export_dir:
+            print(f"✓ 已导出 {store.export_directory(args.export_dir)} 个模板")
+        store.close()
+        return
+    
+    if args.batch:
+        if not args.template:
+            parser.error("--batch 需要同时指定 --template")
+        store = store or DirectoryStore(args.templates or default_templates_dir())
+        cache = RenderCache(None if args.no_cache else store.cache_dir)
+        try:
+            count = run_batch(store, args.template, args.batch, args.export or "-", cache)
+        except (FileNotFoundError, KeyError) as e:
+            parser.error(f"模板或输入文件不存在：{e}")
+        except (BatchError, ExportError) as e:
+            parser.error(str(e))
+        store.close()
+        stats = cache.stats()
+        print(f"✓ 已渲染 {count} 条（内存命中 {stats['memory_hits']}，磁盘命中 {stats['disk_hits']}，"
+              f"未命中 {stats['misses']}）", file=sys.stderr)
+        return
+    
+    if args.export:
+        if not args.template:
+            parser.error("--export 需要同时指定 --template")
+        store = store or DirectoryStore(args.templates or default_templates_dir())
+        try:
+            values = parse_template(store.load(args.template)[0])
+        except (FileNotFoundError, KeyError):
+            parser.error(f"模板不存在：{args.template}")
+        if args.input:
+            if args.input == "-":
+                values["User Input"] = sys.stdin.read()
+            else:
+                try:
+                    with open(args.input, "r", encoding="utf-8") as f:
+                        values["User Input"] = f.read()
+                except OSError as e:
+                    parser.error(f"无法读取输入文件：{e}")
+        try:
+            written = export_prompt(values, args.export, fmt=args.format)
+        except ExportError as e:
+            parser.error(str(e))
+        except OSError as e:
+            parser.error(f"导出失败：{e}")
+        store.close()
+        # 导出到标准输出时，提示信息写到标准错误，避免混入导出内容
+        print(f"✓ 已导出 {written:,} 字符", file=sys.stderr)
+        return
+    
+    if args.serve:
+        # 服务模式按需导入，避免拖慢界面启动
+        from render_service import serve
+        serve(store or DirectoryStore(args.templates or default_templates_dir()), host=args.host, port=args.port,
+              use_cache=not args.no_cache)
+        return
+    
     root = Tk()
-    app = PromptComposer(root)
-    root.mainloop()
+    diagnostics = None
+    if args.diagnostics is not None:
+        # 诊断模式按需导入
+        from diagnostics import Diagnostics, default_output_path
+        output_path = args.diagnostics or default_output_path(os.path.dirname(default_templates_dir()))
+        diagnostics = Diagnostics(root, output_path)
+        diagnostics.start()
+    
+    app = PromptComposer(root, templates_dir=args.templates, store=store,
+                         undo_memory_limit=args.undo_limit * 1024 * 1024, use_render_cache=not args.no_cache,
+                         diagnostics=diagnostics)
+    try:
+        root.mainloop()
+    finally:
+        if diagnostics is not None:
+            diagnostics.close()
+            print(f"✓ 诊断记录已保存: {diagnostics.output_path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+渲染结果缓存
+以「模板内容哈希 + 字段内容哈希」为键缓存生成好的提示词，分两级：
+- 内存：按字节数限制容量的 LRU
+- 磁盘：以键为文件名的内容寻址存储，超出容量时按最近使用时间淘汰
+重复渲染相同的模板与输入时，只需计算哈希并读取缓存
+各方法可在多个线程中同时调用（渲染服务在线程池中读写磁盘缓存）
+"""
+
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+
+from template_engine import render_prompt
+
+# 缓存目录名（位于模板目录下）
+CACHE_DIR_NAME = ".cache"
+
+# 默认内存容量（字节）
+DEFAULT_MEMORY_LIMIT = 32 * 1024 * 1024
+
+# 默认磁盘容量（字节）
+DEFAULT_DISK_LIMIT = 512 * 1024 * 1024
+
+# 磁盘超出容量时，淘汰到该比例以下，避免每次写入都触发淘汰
+DISK_EVICT_RATIO = 0.9
+
+# 超过内存容量该比例的单条结果只写入磁盘
+MEMORY_ENTRY_RATIO = 0.25
+
+
+def fields_hash(fields):
+    """计算字段内容的哈希（与字段顺序无关）"""
+    digest = hashlib.sha256()
+    for field_name in sorted(fields):
+        digest.update(field_name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update((fields[field_name] or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def make_key(template_hash, fields):
+    """缓存键：模板内容哈希 + 字段内容哈希"""
+    return hashlib.sha256(f"{template_hash or ''}:{fields_hash(fields)}".encode("ascii")).hexdigest()
+
+
+class RenderCache:
+    """两级渲染结果缓存；cache_dir 为 None 时只使用内存"""
+
+    def __init__(self, cache_dir=None, memory_limit=DEFAULT_MEMORY_LIMIT, disk_limit=DEFAULT_DISK_LIMIT):
+        self.cache_dir = cache_dir
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.memory_used = 0
+        self._memory = OrderedDict()
+        # 磁盘条目索引（键 -> 大小，按最近使用排序）与占用字节数：首次写入时扫描一次目录，之后增量维护
+        self._disk_index = None
+        self._disk_used = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ---------- 内存 ----------
+
+    def _remember(self, key, text):
+        size = sys.getsizeof(text)
+        if size > self.memory_limit * MEMORY_ENTRY_RATIO:
+            return
+        with self._lock:
+            if key in self._memory:
+                self.memory_used -= sys.getsizeof(self._memory.pop(key))
+            self._memory[key] = text
+            self.memory_used += size
+            while self.memory_used > self.memory_limit:
+                _, evicted = self._memory.popitem(last=False)
+                self.memory_used -= sys.getsizeof(evicted)
+
+    # ---------- 磁盘 ----------
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key[2:])
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                text = f.read().decode("utf-8")
+        except FileNotFoundError:
+            return None
+        # 更新修改时间，作为淘汰时的最近使用时间
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if self._disk_index is not None and key in self._disk_index:
+                self._disk_index.move_to_end(key)
+        return text
+
+    def _write_disk(self, key, text):
+        """写入磁盘（先写临时文件再替换，多个进程同时写入同一条目也不会损坏）"""
+        data = text.encode("utf-8")
+        if len(data) > self.disk_limit:
+            return
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        self._load_disk_index()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if key in self._disk_index:
+                return
+            self._disk_index[key] = len(data)
+            self._disk_used += len(data)
+            evicted = self._evict_disk() if self._disk_used > self.disk_limit else []
+        for evicted_key in evicted:
+            try:
+                os.remove(self._path(evicted_key))
+            except FileNotFoundError:
+                pass
+
+    def _load_disk_index(self):
+        """首次写入前扫描一次磁盘缓存，按修改时间建立索引"""
+        if self._disk_index is not None:
+            return
+        index = OrderedDict()
+        for _, size, path in sorted(self._disk_entries()):
+            if not path.endswith(".tmp"):
+                index[os.path.basename(os.path.dirname(path)) + os.path.basename(path)] = size
+        with self._lock:
+            if self._disk_index is None:
+                self._disk_index = index
+                self._disk_used = sum(index.values())
+
+    def _disk_entries(self):
+        """列出磁盘条目 [(修改时间, 大小, 路径), ...]"""
+        entries = []
+        if not self.cache_dir:
+            return entries
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    def disk_size(self):
+        """统计磁盘缓存占用的字节数"""
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _evict_disk(self):
+        """按最近使用顺序从旧到新移出索引，直到低于容量的 DISK_EVICT_RATIO，返回需要删除的键（调用方持有锁）"""
+        target = self.disk_limit * DISK_EVICT_RATIO
+        evicted = []
+        while self._disk_index and self._disk_used > target:
+            key, size = self._disk_index.popitem(last=False)
+            self._disk_used -= size
+            evicted.append(key)
+        return evicted
+
+    # ---------- 读写 ----------
+
+    def get(self, key):
+        """读取缓存，未命中时返回 None"""
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return text
+        if self.cache_dir:
+            text = self._read_disk(key)
+            if text is not None:
+                self._remember(key, text)
+                with self._lock:
+                    self.disk_hits += 1
+                return text
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, text, persist=True):
+        """写入缓存；persist 为 False 时只放入内存"""
+        self._remember(key, text)
+        if persist and self.cache_dir:
+            try:
+                self._write_disk(key, text)
+            except OSError as e:
+                print(f"⚠ 写入渲染缓存失败: {e}")
+
+    def render(self, values, template_hash=None, overrides=None, persist=True):
+        """带缓存地渲染提示词
+
+        提供 template_hash 时，values 应由该模板的字段加上 overrides 覆盖得到，
+        缓存键只需计算模板哈希与覆盖字段，不必对模板中的大段内容重复计算哈希；
+        否则以 values 的全部内容计算缓存键
+        """
+        key = make_key(template_hash, values if template_hash is None else overrides or {})
+        prompt = self.get(key)
+        if prompt is None:
+            prompt = render_prompt(values)
+            self.put(key, prompt, persist)
+        return prompt
+
+    def stats(self):
+        """命中统计"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self.memory_used,
+            "disk_bytes": self._disk_used,
+        }
+
+    def clear(self):
+        """清空内存缓存并删除磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+            self.memory_used = 0
+            self._disk_index = OrderedDict() if self.cache_dir else None
+            self._disk_used = 0 if self.cache_dir else None
+        for _, _, path in self._disk_entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
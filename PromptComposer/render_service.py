@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地提示词渲染服务
+基于 asyncio 的轻量 HTTP 服务，常驻内存缓存已解析的模板，供内部工具按需生成提示词
+
+接口：
+    GET  /health                 健康检查
+    GET  /templates              模板列表
+    GET  /templates/<名称>        模板各字段内容
+    GET  /search?q=<关键词>       按名称和内容搜索模板
+    POST /render                 渲染单个提示词：{"template": "demo", "fields": {"User Input": "..."}}
+    POST /render/batch           批量渲染：{"items": [{...}, {...}]}
+    GET  /stats                  渲染缓存命中统计
+"""
+
+import json
+import asyncio
+import hashlib
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from template_engine import parse_template, render_prompt, normalize_field_name, sanitize_template_name
+from render_cache import RenderCache, make_key
+
+# 单个请求体的最大字节数
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+# 长连接空闲超时（秒）
+KEEP_ALIVE_TIMEOUT = 30
+
+# 搜索结果最大条数
+SEARCH_LIMIT = 50
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class RequestError(Exception):
+    """请求处理错误，携带 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class TemplateLibrary:
+    """常驻内存的模板库：按存储中的版本号增量刷新，未变化的模板不会重复解析"""
+
+    def __init__(self, store):
+        self.store = store
+        # 名称 -> (版本号, 字段内容, 内容哈希)
+        self._templates = {}
+        # 名称 -> (版本号, 各字段的小写形式)，搜索时使用
+        self._lowered = {}
+        self._names = None
+
+    def names(self):
+        """获取模板名称列表（存储有变化时才重新读取）"""
+        if self._names is None or self.store.poll_changes():
+            self._names = self.store.list_names()
+            # 清理已删除模板的缓存
+            for name in set(self._templates) - set(self._names):
+                del self._templates[name]
+                self._lowered.pop(name, None)
+        return self._names
+
+    def get(self, name):
+        """获取模板字段内容，模板不存在时抛出 KeyError"""
+        return self.get_with_hash(name)[0]
+
+    def get_with_hash(self, name):
+        """获取 (模板字段内容, 模板内容哈希)，模板不存在时抛出 KeyError"""
+        # 拒绝包含路径分隔符等非法字符的名称，防止越出模板目录
+        if not name or sanitize_template_name(name) != name:
+            raise KeyError(name)
+        version = self.store.version(name)
+        if not version:
+            self._templates.pop(name, None)
+            raise KeyError(name)
+
+        cached = self._templates.get(name)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+
+        try:
+            content, version = self.store.load(name)
+        except FileNotFoundError:
+            raise KeyError(name)
+        fields = parse_template(content)
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        self._templates[name] = (version, fields, content_hash)
+        return fields, content_hash
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """按名称和字段内容搜索模板（不区分大小写），返回匹配的模板及命中字段
+
+        SQLite 存储直接在数据库中查询段落表，不必读出并解析每个模板
+        """
+        if hasattr(self.store, "search"):
+            return self.store.search(query, limit)
+        query = query.strip().lower()
+        results = []
+        for name in self.names():
+            try:
+                lowered = self._lowered_fields(name)
+            except (KeyError, OSError):
+                continue
+            matched = [field_name for field_name, text in lowered.items() if query in text]
+            if query in name.lower() or matched:
+                results.append({"name": name, "fields": matched})
+                if len(results) >= limit:
+                    break
+        return results
+
+
+    def _lowered_fields(self, name):
+        """模板各字段的小写形式，按版本号缓存，每次搜索不必重新转换"""
+        fields = self.get(name)
+        version = self._templates[name][0]
+        cached = self._lowered.get(name)
+        if cached is None or cached[0] != version:
+            cached = (version, {field_name: text.lower() for field_name, text in fields.items()})
+            self._lowered[name] = cached
+        return cached[1]
+
+
+class RenderService:
+    """HTTP 渲染服务"""
+
+    def __init__(self, library, cache=None):
+        self.library = library
+        self.cache = cache
+
+    def _build_values(self, item):
+        """合并模板字段与请求中的覆盖字段，返回 (字段内容, 缓存键)"""
+        if not isinstance(item, dict):
+            raise RequestError(400, "渲染请求必须是 JSON 对象")
+        values = {}
+        template_hash = None
+        template_name = item.get("template")
+        if template_name:
+            try:
+                fields, template_hash = self.library.get_with_hash(template_name)
+            except KeyError:
+                raise RequestError(404, f"模板不存在：{template_name}")
+            values.update(fields)
+        fields = item.get("fields") or {}
+        if not isinstance(fields, dict):
+            raise RequestError(400, "fields 必须是 JSON 对象")
+        overrides = {}
+        for title, text in fields.items():
+            if not isinstance(text, str):
+                raise RequestError(400, f"字段 {title} 的内容必须是字符串")
+            overrides[normalize_field_name(title)] = text
+        values.update(overrides)
+        # 有模板时只需对覆盖字段计算哈希
+        key = make_key(template_hash, values if template_hash is None else overrides)
+        return values, key
+
+    async def render_values(self, values_list, keys=None):
+        """渲染多组字段：先查缓存，未命中的直接渲染
+
+        渲染只是字符串拼接，即使是 MB 级的字段也只需几毫秒，
+        交给进程池时序列化参数与结果的开销反而大于渲染本身；
+        启用缓存时要读写磁盘，整批放到线程池中执行，不阻塞事件循环
+        """
+        if self.cache is None or keys is None:
+            return [render_prompt(values) for values in values_list]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._render_cached, values_list, keys)
+
+    def _render_cached(self, values_list, keys):
+        prompts = []
+        for values, key in zip(values_list, keys):
+            prompt = self.cache.get(key)
+            if prompt is None:
+                prompt = render_prompt(values)
+                self.cache.put(key, prompt)
+            prompts.append(prompt)
+        return prompts
+
+    async def render_many(self, items):
+        """批量渲染请求，单项出错不影响其他项"""
+        results = [None] * len(items)
+        valid = []
+        for i, item in enumerate(items):
+            try:
+                valid.append((i, self._build_values(item)))
+            except RequestError as e:
+                results[i] = {"error": str(e)}
+        prompts = await self.render_values([values for _, (values, _) in valid],
+                                           [key for _, (_, key) in valid])
+        for (i, _), prompt in zip(valid, prompts):
+            results[i] = {"prompt": prompt}
+        return results
+
+    async def dispatch(self, method, target, body):
+        """根据请求路径分发，返回 (状态码, 响应对象)"""
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip("/") or "/"
+
+        if path == "/health":
+            return 200, {"status": "ok"}
+
+        if path == "/stats":
+            self._require_method(method, "GET")
+            return 200, {"cache": self.cache.stats() if self.cache is not None else None}
+
+        if path == "/templates":
+            self._require_method(method, "GET")
+            return 200, {"templates": self.library.names()}
+
+        if path.startswith("/templates/"):
+            self._require_method(method, "GET")
+            name = path[len("/templates/"):]
+            try:
+                return 200, {"name": name, "fields": self.library.get(name)}
+            except KeyError:
+                raise RequestError(404, f"模板不存在：{name}")
+
+        if path == "/search":
+            self._require_method(method, "GET")
+            query = parse_qs(url.query).get("q", [""])[0]
+            if not query.strip():
+                raise RequestError(400, "缺少搜索关键词 q")
+            if hasattr(self.library.store, "search"):
+                # SQLite 存储在数据库中一次查询完成（连接只能在创建它的线程中使用）
+                return 200, {"results": self.library.search(query)}
+            # 目录存储需要逐个读取模板，放到线程池中执行，不阻塞其他连接
+            loop = asyncio.get_running_loop()
+            return 200, {"results": await loop.run_in_executor(None, self.library.search, query)}
+
+        if path == "/render":
+            self._require_method(method, "POST")
+            values, key = self._build_values(self._parse_json(body))
+            return 200, {"prompt": (await self.render_values([values], [key]))[0]}
+
+        if path == "/render/batch":
+            self._require_method(method, "POST")
+            items = self._parse_json(body).get("items")
+            if not isinstance(items, list):
+                raise RequestError(400, "items 必须是 JSON 数组")
+            return 200, {"results": await self.render_many(items)}
+
+        raise RequestError(404, f"未知接口：{path}")
+
+    @staticmethod
+    def _require_method(method, expected):
+        if method != expected:
+            raise RequestError(405, f"该接口仅支持 {expected} 请求")
+
+    @staticmethod
+    def _parse_json(body):
+        try:
+            data = json.loads(body.decode("utf-8") if body else "{}")
+        except (UnicodeDecodeError, ValueError) as e:
+            raise RequestError(400, f"请求体不是合法的 JSON：{e}")
+        if not isinstance(data, dict):
+            raise RequestError(400, "请求体必须是 JSON 对象")
+        return data
+
+    async def handle_connection(self, reader, writer):
+        """处理单个连接，支持 HTTP/1.1 长连接（同一连接上依次处理多个请求）"""
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {"error": "请求行格式错误"}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+                try:
+                    length = int(headers.get("content-length", "0"))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > MAX_BODY_SIZE:
+                    status = 400 if length < 0 else 413
+                    await self._send(writer, status, {"error": HTTP_REASONS[status]}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, payload = await self.dispatch(method.upper(), target, body)
+                except RequestError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": f"渲染失败：{e}"}
+
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _send(writer, status, payload, keep_alive):
+        """发送 JSON 响应"""
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                "\r\n")
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+
+async def run_server(service, host, port):
+    """启动服务并持续运行"""
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    addresses = ", ".join(f"http://{sock.getsockname()[0]}:{sock.getsockname()[1]}" for sock in server.sockets)
+    store = service.library.store
+    print(f"✓ 渲染服务已启动: {addresses}")
+    print(f"  模板存储: {getattr(store, 'db_path', None) or store.templates_dir}")
+    if service.cache is not None:
+        print(f"  渲染缓存: {service.cache.cache_dir}")
+    async with server:
+        await server.serve_forever()
+
+
+def serve(store, host="127.0.0.1", port=8765, use_cache=True):
+    """以阻塞方式运行渲染服务（模板来自 store：模板目录或 SQLite 共享存储），Ctrl+C 退出"""
+    cache = RenderCache(store.cache_dir) if use_cache else None
+    service = RenderService(TemplateLibrary(store), cache=cache)
+    try:
+        asyncio.run(run_server(service, host, port))
+    except KeyboardInterrupt:
+        print("渲染服务已停止")
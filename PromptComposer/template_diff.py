@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板比较与合并
+- 按 `# 角色/背景/...` 结构逐段比较，只对哈希不同的段计算差异
+- 行级 / 词级差异使用线性空间的 Myers 算法（中间蛇分治）
+- 词级切分对中日韩文字逐字切分，英文、数字按单词切分
+- 三方合并：以共同的基准版本逐段合并，无法自动合并的行以冲突标记输出
+"""
+
+import re
+import time
+import hashlib
+
+from template_engine import FIELD_ORDER, parse_template, render_section
+
+# 单次差异计算的时间上限（秒），超时后剩余部分按整体替换处理
+DIFF_TIMEOUT = 5.0
+
+# 界面中比较时的时间上限（秒），宁可差异粗一些也要尽快显示
+GUI_DIFF_TIMEOUT = 0.5
+
+# 中日韩文字（逐字切分）、其他单词字符、空白、其余单个字符
+CJK_CHARS = "぀-ヿ㐀-䶿一-鿿豈-﫿가-힯＀-￯"
+WORD_PATTERN = re.compile(rf"[{CJK_CHARS}]|[^\W{CJK_CHARS}]+|\s+|.", re.DOTALL)
+
+# 三方合并的冲突标记
+CONFLICT_OURS = "<<<<<<< 当前"
+CONFLICT_SEPARATOR = "======="
+CONFLICT_THEIRS = ">>>>>>> 对方"
+
+
+def tokenize_words(text):
+    """按词切分：中日韩文字逐字，英文/数字按单词，空白与标点单独成词"""
+    return WORD_PATTERN.findall(text)
+
+
+def section_hash(text):
+    """计算段落内容哈希"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+# ---------- Myers 差异算法 ----------
+
+def _bisect(a, b, deadline):
+    """查找中间蛇，返回分割点 (x, y)；超时或无公共部分时返回 None"""
+    n, m = len(a), len(b)
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = n - m
+    # 长度差为奇数时由正向搜索检测重叠，否则由反向搜索检测
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+
+    for d in range(max_d):
+        if time.monotonic() > deadline:
+            return None
+
+        # 正向搜索
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[x1] == b[y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    if x1 >= n - v2[k2_offset]:
+                        return x1, y1
+
+        # 反向搜索
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[n - x2 - 1] == b[m - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = v_offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return x1, y1
+    return None
+
+
+def _diff_range(a, b, alo, ahi, blo, bhi, deadline, ops):
+    """计算 a[alo:ahi] 与 b[blo:bhi] 的差异，结果追加到 ops"""
+    # 去掉公共前缀和后缀
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        ops.append(("equal", alo, alo + 1, blo, blo + 1))
+        alo += 1
+        blo += 1
+    suffix = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix.append(("equal", ahi, ahi + 1, bhi, bhi + 1))
+
+    if alo == ahi or blo == bhi:
+        if alo < ahi:
+            ops.append(("delete", alo, ahi, blo, blo))
+        if blo < bhi:
+            ops.append(("insert", alo, alo, blo, bhi))
+    else:
+        split = _bisect(a[alo:ahi], b[blo:bhi], deadline)
+        if split is None:
+            ops.append(("replace", alo, ahi, blo, bhi))
+        else:
+            x, y = split
+            _diff_range(a, b, alo, alo + x, blo, blo + y, deadline, ops)
+            _diff_range(a, b, alo + x, ahi, blo + y, bhi, deadline, ops)
+    ops.extend(reversed(suffix))
+
+
+def diff_sequences(a, b, timeout=DIFF_TIMEOUT):
+    """比较两个序列，返回与 difflib 相同格式的操作码 [(tag, i1, i2, j1, j2), ...]"""
+    # 先将元素映射为整数，加快比较
+    ids = {}
+    a_ids = [ids.setdefault(item, len(ids)) for item in a]
+    b_ids = [ids.setdefault(item, len(ids)) for item in b]
+
+    # 没有任何相同元素时整体替换，不必搜索
+    if a_ids and b_ids and len(ids) == len(set(a_ids)) + len(set(b_ids)):
+        return [("replace", 0, len(a_ids), 0, len(b_ids))]
+
+    raw = []
+    _diff_range(a_ids, b_ids, 0, len(a_ids), 0, len(b_ids), time.monotonic() + timeout, raw)
+
+    # 合并相邻的同类操作，相邻的删除 + 插入合并为替换
+    opcodes = []
+    for tag, i1, i2, j1, j2 in raw:
+        if opcodes:
+            last_tag, li1, li2, lj1, lj2 = opcodes[-1]
+            if li2 == i1 and lj2 == j1 and (last_tag == tag or (last_tag != "equal" and tag != "equal")):
+                merged_tag = last_tag if last_tag == tag else "replace"
+                opcodes[-1] = (merged_tag, li1, i2, lj1, j2)
+                continue
+        opcodes.append((tag, i1, i2, j1, j2))
+    return opcodes
+
+
+def diff_lines(text_a, text_b, timeout=DIFF_TIMEOUT):
+    """行级差异，返回 (a 的行列表, b 的行列表, 操作码)"""
+    lines_a = text_a.splitlines()
+    lines_b = text_b.splitlines()
+    return lines_a, lines_b, diff_sequences(lines_a, lines_b, timeout)
+
+
+def diff_words(text_a, text_b, timeout=DIFF_TIMEOUT):
+    """词级差异，返回 (a 中变化的字符区间列表, b 中变化的字符区间列表)"""
+    tokens_a = tokenize_words(text_a)
+    tokens_b = tokenize_words(text_b)
+    offsets_a = _token_offsets(tokens_a)
+    offsets_b = _token_offsets(tokens_b)
+    spans_a, spans_b = [], []
+    for tag, i1, i2, j1, j2 in diff_sequences(tokens_a, tokens_b, timeout):
+        if tag == "equal":
+            continue
+        if i2 > i1:
+            spans_a.append((offsets_a[i1], offsets_a[i2]))
+        if j2 > j1:
+            spans_b.append((offsets_b[j1], offsets_b[j2]))
+    return spans_a, spans_b
+
+
+def _token_offsets(tokens):
+    offsets = [0]
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token))
+    return offsets
+
+
+# ---------- 按段比较 ----------
+
+class SectionDiff:
+    """单个段落的比较结果；行级差异在首次访问时才计算"""
+
+    def __init__(self, field, text_a, text_b, timeout=DIFF_TIMEOUT):
+        self.field = field
+        self.text_a = text_a
+        self.text_b = text_b
+        self.timeout = timeout
+        if text_a is None:
+            self.status = "added"
+        elif text_b is None:
+            self.status = "removed"
+        elif section_hash(text_a) == section_hash(text_b):
+            self.status = "equal"
+        else:
+            self.status = "changed"
+        self._lines = None
+
+    @property
+    def lines(self):
+        """(a 的行列表, b 的行列表, 操作码)"""
+        if self._lines is None:
+            self._lines = diff_lines(self.text_a or "", self.text_b or "", self.timeout)
+        return self._lines
+
+
+def ordered_fields(*field_maps):
+    """按标准字段顺序排列，未知段落按出现顺序排在后面"""
+    fields = [field for field in FIELD_ORDER if any(field in fields for fields in field_maps)]
+    for field_map in field_maps:
+        for field in field_map:
+            if field not in fields:
+                fields.append(field)
+    return fields
+
+
+def diff_templates(content_a, content_b, timeout=DIFF_TIMEOUT):
+    """逐段比较两个模板，返回 [SectionDiff, ...]；timeout 为每段差异计算的时间上限"""
+    fields_a = parse_template(content_a)
+    fields_b = parse_template(content_b)
+    return [SectionDiff(field, fields_a.get(field), fields_b.get(field), timeout)
+            for field in ordered_fields(fields_a, fields_b)]
+
+
+# ---------- 三方合并 ----------
+
+def _hunks(base, other):
+    return [(i1, i2, j1, j2) for tag, i1, i2, j1, j2 in diff_sequences(base, other) if tag != "equal"]
+
+
+def merge_lines(base, ours, theirs):
+    """三方合并行列表，返回 (合并后的行列表, 冲突数量)"""
+    changes = sorted([(i1, i2, j1, j2, 0) for i1, i2, j1, j2 in _hunks(base, ours)] +
+                     [(i1, i2, j1, j2, 1) for i1, i2, j1, j2 in _hunks(base, theirs)])
+    sides = (ours, theirs)
+    merged = []
+    conflicts = 0
+    # 两侧在已处理位置之前的行号偏移
+    shift = [0, 0]
+    position = 0
+    index = 0
+    while index < len(changes):
+        # 将基准区间重叠（或相邻）的修改归为一组
+        lo, hi = changes[index][0], changes[index][1]
+        group = [changes[index]]
+        index += 1
+        while index < len(changes) and changes[index][0] <= hi:
+            hi = max(hi, changes[index][1])
+            group.append(changes[index])
+            index += 1
+
+        merged.extend(base[position:lo])
+        position = hi
+
+        # 计算每一侧在该组基准区间 [lo, hi) 上对应的内容
+        replacement = []
+        for side in (0, 1):
+            side_changes = [change for change in group if change[4] == side]
+            if not side_changes:
+                replacement.append(None)
+                continue
+            start = lo + shift[side]
+            growth = sum((j2 - j1) - (i2 - i1) for i1, i2, j1, j2, _ in side_changes)
+            replacement.append(sides[side][start:hi + shift[side] + growth])
+            shift[side] += growth
+
+        ours_lines, theirs_lines = replacement
+        if theirs_lines is None:
+            merged.extend(ours_lines)
+        elif ours_lines is None:
+            merged.extend(theirs_lines)
+        elif ours_lines == theirs_lines:
+            merged.extend(ours_lines)
+        else:
+            conflicts += 1
+            merged.append(CONFLICT_OURS)
+            merged.extend(ours_lines)
+            merged.append(CONFLICT_SEPARATOR)
+            merged.extend(theirs_lines)
+            merged.append(CONFLICT_THEIRS)
+    merged.extend(base[position:])
+    return merged, conflicts
+
+
+def merge_templates(base_content, ours_content, theirs_content):
+    """逐段三方合并模板，返回 (合并后的模板内容, 冲突数量)"""
+    base = parse_template(base_content or "")
+    ours = parse_template(ours_content)
+    theirs = parse_template(theirs_content)
+
+    sections = []
+    conflicts = 0
+    for field in ordered_fields(ours, theirs):
+        base_text, ours_text, theirs_text = base.get(field), ours.get(field), theirs.get(field)
+        if ours_text == theirs_text:
+            text = ours_text
+        elif ours_text == base_text:
+            text = theirs_text
+        elif theirs_text == base_text:
+            text = ours_text
+        else:
+            lines, count = merge_lines((base_text or "").splitlines(), (ours_text or "").splitlines(),
+                                       (theirs_text or "").splitlines())
+            text = "\n".join(lines)
+            conflicts += count
+        if text:
+            sections.append(render_section(field, text))
+    return "\n\n".join(sections), conflicts
+
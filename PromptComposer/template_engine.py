@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示词模板引擎
+模板的解析与提示词拼接逻辑，供桌面端和渲染服务共用（仅依赖标准库）
+"""
+
+import os
+import re
+import sys
+
+# 字段顺序（同时也是生成提示词时各部分的顺序）
+FIELD_ORDER = ["Role", "Context", "Task", "Examples", "Constraints", "User Input"]
+
+# 字段名中英文映射
+FIELD_NAMES = {
+    "Role": "角色",
+    "Context": "背景",
+    "Task": "任务",
+    "Examples": "示例",
+    "Constraints": "约束",
+    "User Input": "用户输入"
+}
+
+# 中文标题转换为英文字段名
+CHINESE_TO_FIELD = {v: k for k, v in FIELD_NAMES.items()}
+
+# 匹配格式：# 标题\n内容（直到下一个 # 或文件结束）
+SECTION_PATTERN = re.compile(r'^# (.+?)\n(.*?)(?=^# |\Z)', re.MULTILINE | re.DOTALL)
+
+# 用户输入外层的 <user_input> 标签
+USER_INPUT_TAG_PATTERN = re.compile(r'^<user_input>\s*|\s*</user_input>$', re.MULTILINE)
+
+
+def default_templates_dir():
+    """模板目录：始终使用程序所在目录"""
+    if getattr(sys, 'frozen', False):
+        # 打包后的 exe 环境：使用 exe 文件所在目录
+        return os.path.join(os.path.dirname(sys.executable), "templates")
+    # 开发环境：使用脚本所在目录
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+def normalize_field_name(title):
+    """将标题（中文或英文）转换为英文字段名，未知标题原样返回"""
+    title = title.strip()
+    return CHINESE_TO_FIELD.get(title, title)
+
+
+def parse_template(content):
+    """解析 Markdown 模板，返回 {字段名: 内容}（按模板中出现的顺序）"""
+    fields = {}
+    for title, text in SECTION_PATTERN.findall(content):
+        field_name = normalize_field_name(title)
+        text = text.strip()
+
+        # 处理用户输入的特殊情况（移除 <user_input> 标签）
+        if field_name == "User Input":
+            text = USER_INPUT_TAG_PATTERN.sub('', text).strip()
+
+        fields[field_name] = text
+    return fields
+
+
+def render_section(field_name, content):
+    """生成单个字段对应的 Markdown 片段"""
+    display_name = FIELD_NAMES.get(field_name, field_name)
+    if field_name == "User Input":
+        # User Input 需要特殊处理，包裹 XML 标签
+        return f"# {display_name}\n<user_input>\n{content}\n</user_input>"
+    return f"# {display_name}\n{content}"
+
+
+def render_prompt(values):
+    """按固定字段顺序拼接所有非空部分，生成提示词"""
+    sections = []
+    for field_name in FIELD_ORDER:
+        content = (values.get(field_name) or "").strip()
+        if content:
+            sections.append(render_section(field_name, content))
+    return "\n\n".join(sections)
+
+
+def list_template_names(templates_dir):
+    """列出模板目录中的所有模板名称（按字母排序）"""
+    try:
+        entries = os.scandir(templates_dir)
+    except FileNotFoundError:
+        return []
+    with entries:
+        names = [os.path.splitext(entry.name)[0] for entry in entries
+                 if entry.is_file() and entry.name.endswith(".md")]
+    return sorted(names)
+
+
+def sanitize_template_name(name):
+    """过滤模板名称中的非法字符"""
+    return re.sub(r'[\\/:*?"<>|]', '_', name)
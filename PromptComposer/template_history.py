@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板历史版本库
+每次保存时将模板按 `# 标题` 拆分为若干段，以内容哈希为键存储：
+- 不同版本、不同模板中相同的段只存储一份
+- 较大的段发生变化时，只存储相对上一版本同名段的压缩差量
+- 版本清单按模板逐行追加，列出历史与恢复版本都只需读取少量文件
+"""
+
+import os
+import re
+import json
+import zlib
+import hashlib
+from datetime import datetime
+
+# 历史版本库目录名（位于模板目录下）
+HISTORY_DIR_NAME = ".history"
+
+# 小于该字节数的段直接完整存储，不计算差量
+DELTA_MIN_SIZE = 4 * 1024
+
+# 差量链最大长度，超过后重新完整存储，保证恢复速度
+MAX_DELTA_CHAIN = 16
+
+# 差量压缩后需小于原文的该比例才采用差量
+DELTA_MAX_RATIO = 0.5
+
+# 内存中保留最近读写的段落数，连续保存同一模板时无需重新还原差量链
+RECENT_CACHE_SIZE = 16
+
+# 对象类型标记
+FULL_OBJECT = b"F"
+DELTA_OBJECT = b"D"
+
+# 按一级标题切分模板，切分后的各段直接拼接即可还原原文
+SECTION_SPLIT_PATTERN = re.compile(r'^(?=# )', re.MULTILINE)
+
+
+def split_sections(content):
+    """将模板原文切分为 [(标题, 原始段落文本), ...]，各段拼接后与原文完全一致"""
+    sections = []
+    for chunk in SECTION_SPLIT_PATTERN.split(content):
+        if not chunk:
+            continue
+        title = chunk.split("\n", 1)[0][2:].strip() if chunk.startswith("# ") else ""
+        sections.append((title, chunk))
+    return sections
+
+
+def content_hash(text):
+    """计算文本的内容哈希"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_delta(base, target):
+    """基于行计算差量：复制基准中的行区间，或插入新文本
+
+    以行内容建立索引后线性扫描目标文本，优先延续上一段复制区间，
+    对大段落（数 MB）也能在线性时间内完成
+    """
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    line_index = {}
+    for i, line in enumerate(base_lines):
+        line_index.setdefault(line, i)
+
+    ops = []
+    pending = []
+    j = 0
+    while j < len(target_lines):
+        line = target_lines[j]
+        # 优先延续上一段复制区间，避免重复行（如空行）被映射到别处
+        if not pending and ops and not isinstance(ops[-1], str) \
+                and ops[-1][1] < len(base_lines) and base_lines[ops[-1][1]] == line:
+            start = ops[-1][1]
+        else:
+            start = line_index.get(line)
+        if start is None:
+            pending.append(line)
+            j += 1
+            continue
+
+        i = start
+        while j < len(target_lines) and i < len(base_lines) and base_lines[i] == target_lines[j]:
+            i += 1
+            j += 1
+        if pending:
+            ops.append("".join(pending))
+            pending = []
+        if ops and not isinstance(ops[-1], str) and ops[-1][1] == start:
+            ops[-1][1] = i
+        else:
+            ops.append([start, i])
+    if pending:
+        ops.append("".join(pending))
+    return ops
+
+
+def apply_delta(base, ops):
+    """将差量应用到基准文本"""
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base_lines[op[0]:op[1]])
+    return "".join(parts)
+
+
+class TemplateHistory:
+    """模板历史版本库"""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.objects_dir = os.path.join(root_dir, "objects")
+        self.versions_dir = os.path.join(root_dir, "versions")
+        # 内容哈希 -> (文本, 差量链深度)
+        self._recent = {}
+
+    # ---------- 对象存储 ----------
+
+    def _object_path(self, blob_hash):
+        return os.path.join(self.objects_dir, blob_hash[:2], blob_hash[2:])
+
+    def has_object(self, blob_hash):
+        """判断对象是否已存在"""
+        return os.path.exists(self._object_path(blob_hash))
+
+    def _write_object(self, blob_hash, data):
+        """写入对象（先写临时文件再替换，多个实例同时写入同一对象也不会损坏）"""
+        path = self._object_path(blob_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remember(self, blob_hash, text, depth):
+        """记录最近读写的段落，超出容量时淘汰最早的记录"""
+        self._recent.pop(blob_hash, None)
+        self._recent[blob_hash] = (text, depth)
+        while len(self._recent) > RECENT_CACHE_SIZE:
+            del self._recent[next(iter(self._recent))]
+
+    def _read_object(self, blob_hash):
+        """读取对象，返回 (文本, 差量链深度)"""
+        if blob_hash in self._recent:
+            return self._recent[blob_hash]
+        with open(self._object_path(blob_hash), "rb") as f:
+            data = f.read()
+        kind, payload = data[:1], zlib.decompress(data[1:])
+        if kind == FULL_OBJECT:
+            result = payload.decode("utf-8"), 0
+        else:
+            delta = json.loads(payload.decode("utf-8"))
+            base_text, _ = self._read_object(delta["base"])
+            result = apply_delta(base_text, delta["ops"]), delta["depth"]
+        self._remember(blob_hash, *result)
+        return result
+
+    def load_blob(self, blob_hash):
+        """读取段落文本"""
+        return self._read_object(blob_hash)[0]
+
+    def store_blob(self, text, base_hash=None):
+        """存储段落文本，返回内容哈希；提供基准段时尝试以差量形式存储"""
+        blob_hash = content_hash(text)
+        if self.has_object(blob_hash):
+            return blob_hash
+
+        raw = text.encode("utf-8")
+        data = None
+        depth = 0
+        if base_hash and len(raw) >= DELTA_MIN_SIZE and self.has_object(base_hash):
+            base_text, base_depth = self._read_object(base_hash)
+            if base_depth < MAX_DELTA_CHAIN:
+                delta = {"base": base_hash, "depth": base_depth + 1, "ops": make_delta(base_text, text)}
+                packed = DELTA_OBJECT + zlib.compress(json.dumps(delta, ensure_ascii=False).encode("utf-8"))
+                # 差量足够小时直接采用，省去对大段落的完整压缩
+                if len(packed) < len(raw) * DELTA_MAX_RATIO:
+                    data = packed
+                    depth = delta["depth"]
+        if data is None:
+            data = FULL_OBJECT + zlib.compress(raw)
+        self._write_object(blob_hash, data)
+        self._remember(blob_hash, text, depth)
+        return blob_hash
+
+    # ---------- 版本清单 ----------
+
+    def _manifest_path(self, name):
+        return os.path.join(self.versions_dir, f"{name}.jsonl")
+
+    def list_versions(self, name):
+        """列出模板的所有历史版本（按版本号升序）"""
+        try:
+            with open(self._manifest_path(name), "r", encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def latest_version(self, name):
+        """获取最新版本，没有历史时返回 None"""
+        versions = self.list_versions(name)
+        return versions[-1] if versions else None
+
+    def record(self, name, content):
+        """记录一次保存，返回新版本信息；内容与最新版本相同时返回 None"""
+        latest = self.latest_version(name)
+        full_hash = content_hash(content)
+        if latest and latest["hash"] == full_hash:
+            return None
+
+        # 上一版本中同名段作为差量基准
+        previous = {title: blob_hash for title, blob_hash in latest["sections"]} if latest else {}
+        sections = [[title, self.store_blob(text, previous.get(title))] for title, text in split_sections(content)]
+
+        version = {
+            "version": latest["version"] + 1 if latest else 1,
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "size": len(content),
+            "hash": full_hash,
+            "sections": sections,
+        }
+        os.makedirs(self.versions_dir, exist_ok=True)
+        with open(self._manifest_path(name), "a", encoding="utf-8") as f:
+            f.write(json.dumps(version, ensure_ascii=False) + "\n")
+        return version
+
+    def restore(self, name, version_number):
+        """还原指定版本的模板原文"""
+        for version in self.list_versions(name):
+            if version["version"] == version_number:
+                return "".join(self.load_blob(blob_hash) for _, blob_hash in version["sections"])
+        raise KeyError(f"{name} 不存在版本 {version_number}")
+
+    def storage_size(self):
+        """统计对象存储占用的字节数"""
+        total = 0
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            total += sum(os.path.getsize(os.path.join(dirpath, filename)) for filename in filenames)
+        return total
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板存储后端
+- DirectoryStore：默认后端，每个模板一个 .md 文件（与以往行为一致）
+- SQLiteTemplateStore：可选的共享后端，多人同时使用同一个数据库文件
+  * WAL 模式，读写互不阻塞（数据库位于网络共享上时改用 DELETE 日志模式）
+  * 按段落存储字段内容，搜索在数据库内完成，不必读出并解析每个模板
+  * 保存时基于版本号做乐观并发控制，避免互相覆盖
+  * 通过变更日志通知客户端，只刷新发生变化的模板
+"""
+
+import os
+import sys
+import sqlite3
+import getpass
+from datetime import datetime
+
+from template_engine import parse_template, list_template_names
+from template_history import HISTORY_DIR_NAME
+from render_cache import CACHE_DIR_NAME
+
+# SQLite 等待写锁的超时时间（毫秒）
+BUSY_TIMEOUT_MS = 5000
+
+# 网络文件系统类型（Linux /proc/mounts 中的名称）
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "fuse.sshfs"}
+
+# Windows GetDriveTypeW 返回的网络驱动器类型
+DRIVE_REMOTE = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    name       TEXT PRIMARY KEY,
+    content    TEXT NOT NULL,
+    version    INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    updated_by TEXT
+);
+CREATE TABLE IF NOT EXISTS sections (
+    name  TEXT NOT NULL REFERENCES templates(name) ON DELETE CASCADE,
+    field TEXT NOT NULL,
+    body  TEXT NOT NULL,
+    PRIMARY KEY (name, field)
+);
+CREATE INDEX IF NOT EXISTS idx_sections_field ON sections(field);
+CREATE TABLE IF NOT EXISTS changes (
+    seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+    name    TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    op      TEXT NOT NULL
+);
+"""
+
+
+def is_network_path(path):
+    """判断路径是否位于网络共享上：UNC 路径、Windows 网络驱动器或 Linux 网络文件系统挂载点"""
+    if path.startswith(("\\\\", "//")):
+        return True
+    path = os.path.abspath(path)
+    if sys.platform == "win32":
+        import ctypes
+        drive = os.path.splitdrive(path)[0]
+        return bool(drive) and ctypes.windll.kernel32.GetDriveTypeW(drive + "\\") == DRIVE_REMOTE
+    try:
+        with open("/proc/mounts", "r", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return False
+    # 取包含该路径的最深挂载点
+    fs_type, depth = None, -1
+    for mount_point, mount_type in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        prefix = mount_point.rstrip("/") + "/"
+        if (path == mount_point or path.startswith(prefix)) and len(mount_point) > depth:
+            fs_type, depth = mount_type, len(mount_point)
+    return fs_type in NETWORK_FILESYSTEMS
+
+
+class StoreConflictError(Exception):
+    """保存时发现模板已被其他用户修改"""
+
+    def __init__(self, name, expected_version, current_version):
+        super().__init__(f"模板「{name}」已被修改（期望版本 {expected_version}，当前版本 {current_version}）")
+        self.name = name
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
+class DirectoryStore:
+    """目录存储：每个模板一个 .md 文件，版本号为文件修改时间"""
+
+    def __init__(self, templates_dir):
+        self.templates_dir = templates_dir
+        self.history_dir = os.path.join(templates_dir, HISTORY_DIR_NAME)
+        self.cache_dir = os.path.join(templates_dir, CACHE_DIR_NAME)
+        self._dir_mtime = None
+        self._names = set()
+
+    def _path(self, name):
+        return os.path.join(self.templates_dir, f"{name}.md")
+
+    def version(self, name):
+        """获取模板当前版本号（文件修改时间），模板不存在时返回 0"""
+        try:
+            return os.stat(self._path(name)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def list_names(self):
+        """列出所有模板名称（按字母排序）"""
+        return list_template_names(self.templates_dir)
+
+    def exists(self, name):
+        """判断模板是否存在"""
+        return os.path.exists(self._path(name))
+
+    def load(self, name):
+        """读取模板，返回 (内容, 版本号)"""
+        version = self.version(name)
+        with open(self._path(name), "r", encoding="utf-8") as f:
+            return f.read(), version
+
+    def save(self, name, content, expected_version=None):
+        """保存模板并返回新版本号；expected_version 不为 None 时校验版本，不一致则抛出 StoreConflictError"""
+        if expected_version is not None:
+            current_version = self.version(name)
+            if current_version != expected_version:
+                raise StoreConflictError(name, expected_version, current_version)
+        with open(self._path(name), "w", encoding="utf-8") as f:
+            f.write(content)
+        return self.version(name)
+
+    def poll_changes(self):
+        """检查模板列表是否变化（仅比较目录修改时间），返回新增或删除的模板名称"""
+        try:
+            dir_mtime = os.stat(self.templates_dir).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if dir_mtime == self._dir_mtime:
+            return []
+        first_poll = self._dir_mtime is None
+        self._dir_mtime = dir_mtime
+        names = set(self.list_names())
+        changed = sorted(names ^ self._names)
+        self._names = names
+        # 首次检查只记录基准状态
+        return [] if first_poll else changed
+
+    def close(self):
+        pass
+
+
+class SQLiteTemplateStore:
+    """SQLite 共享存储"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.history_dir = os.path.splitext(db_path)[0] + HISTORY_DIR_NAME
+        self.cache_dir = os.path.splitext(db_path)[0] + CACHE_DIR_NAME
+        self.user = self._current_user()
+
+        # isolation_level=None：由代码显式控制事务
+        self.conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        # WAL 依赖同一台机器上进程间的共享内存，不能用于网络文件系统
+        if is_network_path(db_path):
+            print("⚠ 数据库位于网络共享上，无法使用 WAL 模式，已改用 DELETE 日志模式（保存时会短暂阻塞其他客户端读取）")
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.conn.execute("PRAGMA synchronous=FULL")
+        else:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+        # 只关注打开之后的变更
+        self._last_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._data_version = self._get_data_version()
+        # 本客户端自己写入的变更日志序号，检查变更时跳过
+        self._own_seqs = set()
+
+    @staticmethod
+    def _current_user():
+        try:
+            return getpass.getuser()
+        except Exception:
+            return None
+
+    def _get_data_version(self):
+        # 其他连接提交写入后 data_version 会变化，用于低成本判断是否需要查询变更日志
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def list_names(self):
+        """列出所有模板名称（按字母排序）"""
+        return [row[0] for row in self.conn.execute("SELECT name FROM templates ORDER BY name")]
+
+    def exists(self, name):
+        """判断模板是否存在"""
+        return self.conn.execute("SELECT 1 FROM templates WHERE name = ?", (name,)).fetchone() is not None
+
+    def version(self, name):
+        """获取模板当前版本号，模板不存在时返回 0"""
+        row = self.conn.execute("SELECT version FROM templates WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, name):
+        """读取模板，返回 (内容, 版本号)；模板不存在时抛出 KeyError"""
+        row = self.conn.execute("SELECT content, version FROM templates WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0], row[1]
+
+    def save(self, name, content, expected_version=None):
+        """保存模板并返回新版本号
+
+        expected_version 为读取时的版本号（新建模板为 0），与数据库中不一致时抛出 StoreConflictError；
+        为 None 时直接覆盖
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT version FROM templates WHERE name = ?", (name,)).fetchone()
+            current_version = row[0] if row else 0
+            if expected_version is not None and current_version != expected_version:
+                raise StoreConflictError(name, expected_version, current_version)
+
+            # 以变更日志序号作为版本号：只增不减、删除后重新创建也不会复用，避免 ABA 问题
+            cursor = self.conn.execute("INSERT INTO changes (name, version, op) VALUES (?, 0, 'save')", (name,))
+            new_version = cursor.lastrowid
+            self.conn.execute("UPDATE changes SET version = ? WHERE seq = ?", (new_version, new_version))
+            self.conn.execute(
+                "INSERT INTO templates (name, content, version, updated_at, updated_by) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET content = excluded.content, version = excluded.version, "
+                "updated_at = excluded.updated_at, updated_by = excluded.updated_by",
+                (name, content, new_version, datetime.now().isoformat(timespec="seconds"), self.user))
+            self.conn.execute("DELETE FROM sections WHERE name = ?", (name,))
+            self.conn.executemany("INSERT INTO sections (name, field, body) VALUES (?, ?, ?)",
+                                  [(name, field, body) for field, body in parse_template(content).items()])
+            self.conn.execute("COMMIT")
+            self._own_seqs.add(cursor.lastrowid)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return new_version
+
+    def delete(self, name, expected_version=None):
+        """删除模板"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT version FROM templates WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(name)
+            if expected_version is not None and row[0] != expected_version:
+                raise StoreConflictError(name, expected_version, row[0])
+            self.conn.execute("DELETE FROM templates WHERE name = ?", (name,))
+            cursor = self.conn.execute("INSERT INTO changes (name, version, op) VALUES (?, ?, 'delete')",
+                                       (name, row[0]))
+            self.conn.execute("COMMIT")
+            self._own_seqs.add(cursor.lastrowid)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def search(self, query, limit):
+        """按名称和字段内容搜索模板（英文不区分大小写），返回 [{"name": 名称, "fields": [命中字段, ...]}, ...]"""
+        query = query.strip().lower()
+        rows = self.conn.execute(
+            "SELECT t.name, s.field FROM templates t "
+            "LEFT JOIN sections s ON s.name = t.name AND instr(lower(s.body), ?1) > 0 "
+            "WHERE instr(lower(t.name), ?1) > 0 OR s.field IS NOT NULL "
+            "ORDER BY t.name, s.rowid", (query,))
+        results = []
+        for name, field in rows:
+            if not results or results[-1]["name"] != name:
+                if len(results) >= limit:
+                    break
+                results.append({"name": name, "fields": []})
+            if field is not None:
+                results[-1]["fields"].append(field)
+        return results
+
+    def poll_changes(self):
+        """检查模板列表是否变化（仅比较目录修改时间），返回新增或删除的模板名称"""
+        try:
+            dir_mtime = os.stat(self.templates_dir).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if dir_mtime == self._dir_mtime:
+            return []
+        first_poll = self._dir_mtime is None
+        self._dir_mtime = dir_mtime
+        names = set(self.list_names())
+        changed = sorted(names ^ self._names)
+        self._names = names
+        # 首次检查只记录基准状态
+        return [] if first_poll else changed
+
+    def close(self):
+        pass
+
+
+class SQLiteTemplateStore:
+    """SQLite 共享存储"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.history_dir = os.path.splitext(db_path)[0] + HISTORY_DIR_NAME
+        self.cache_dir = os.path.splitext(db_path)[0] + CACHE_DIR_NAME
+        self.user = self._current_user()
+
+        # isolation_level=None：由代码显式控制事务
+        self.conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        # WAL 依赖同一台机器上进程间的共享内存，不能用于网络文件系统
+        if is_network_path(db_path):
+            print("⚠ 数据库位于网络共享上，无法使用 WAL 模式，已改用 DELETE 日志模式（保存时会短暂阻塞其他客户端读取）")
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.conn.execute("PRAGMA synchronous=FULL")
+        else:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+        # 只关注打开之后的变更
+        self._last_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._data_version = self._get_data_version()
+        # 本客户端自己写入的变更日志序号，检查变更时跳过
+        self._own_seqs = set()
+
+    @staticmethod
+    def _current_user():
+        try:
+            return getpass.getuser()
+        except Exception:
+            return None
+
+    def _get_data_version(self):
+        # 其他连接提交写入后 data_version 会变化，用于低成本判断是否需要查询变更日志
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def list_names(self):
+        """列出所有模板名称（按字母排序）"""
+        return [row[0] for row in self.conn.execute("SELECT name FROM templates ORDER BY name")]
+
+    def exists(self, name):
+        """判断模板是否存在"""
+        return self.conn.execute("SELECT 1 FROM templates WHERE name = ?", (name,)).fetchone() is not None
+
+    def version(self, name):
+        """获取模板当前版本号，模板不存在时返回 0"""
+        row = self.conn.execute("SELECT version FROM templates WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, name):
+        """读取模板，返回 (内容, 版本号)；模板不存在时抛出 KeyError"""
+        row = self.conn.execute("SELECT content, version FROM templates WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0], row[1]
+
+    def save(self, name, content, expected_version=None):
+        """保存模板并返回新版本号
+
+        expected_version 为读取时的版本号（新建模板为 0），与数据库中不一致时抛出 StoreConflictError；
+        为 None 时直接覆盖
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT version FROM templates WHERE name = ?", (name,)).fetchone()
+            current_version = row[0] if row else 0
+            if expected_version is not None and current_version != expected_version:
+                raise StoreConflictError(name, expected_version, current_version)
+
+            # 以变更日志序号作为版本号：只增不减、删除后重新创建也不会复用，避免 ABA 问题
+            cursor = self.conn.execute("INSERT INTO changes (name, version, op) VALUES (?, 0, 'save')", (name,))
+            new_version = cursor.lastrowid
+            self.conn.execute("UPDATE changes SET version = ? WHERE seq = ?", (new_version, new_version))
+            self.conn.execute(
+                "INSERT INTO templates (name, content, version, updated_at, updated_by) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET content = excluded.content, version = excluded.version, "
+                "updated_at = excluded.updated_at, updated_by = excluded.updated_by",
+                (name, content, new_version, datetime.now().isoformat(timespec="seconds"), self.user))
+            self.conn.execute("DELETE FROM sections WHERE name = ?", (name,))
+            self.conn.executemany("INSERT INTO sections (name, field, body) VALUES (?, ?, ?)",
+                                  [(name, field, body) for field, body in parse_template(content).items()])
+            self.conn.execute("COMMIT")
+            self._own_seqs.add(cursor.lastrowid)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return new_version
+
+    def delete(self, name, expected_version=None):
+        """删除模板"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT version FROM templates WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(name)
+            if expected_version is not None and row[0] != expected_version:
+                raise StoreConflictError(name, expected_version, row[0])
+            self.conn.execute("DELETE FROM templates WHERE name = ?", (name,))
+            cursor = self.conn.execute("INSERT INTO changes (name, version, op) VALUES (?, ?, 'delete')",
+                                       (name, row[0]))
+            self.conn.execute("COMMIT")
+            self._own_seqs.add(cursor.lastrowid)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def get_tags(self, name):
+        """获取模板的标签"""
+        return [row[0] for row in self.conn.execute("SELECT tag FROM tags WHERE name = ? ORDER BY tag", (name,))]
+
+    def find(self, tag=None, field=None, text=None):
+        """按标签、字段及字段内容查找模板名称"""
+        query = "SELECT DISTINCT t.name FROM templates t"
+        conditions, params = [], []
+        if tag:
+            query += " JOIN tags g ON g.name = t.name"
+            conditions.append("g.tag = ?")
+            params.append(tag)
+        if field or text:
+            query += " JOIN sections s ON s.name = t.name"
+            if field:
+                conditions.append("s.field = ?")
+                params.append(field)
+            if text:
+                conditions.append("instr(s.body, ?) > 0")
+                params.append(text)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY t.name"
+        return [row[0] for row in self.conn.execute(query, params)]
+
+    def poll_changes(self):
+        """返回自上次检查以来其他客户端修改过的模板名称；没有新提交时只执行一次 PRAGMA 查询"""
+        data_version = self._get_data_version()
+        if data_version == self._data_version:
+            return []
+        self._data_version = data_version
+        rows = self.conn.execute("SELECT seq, name FROM changes WHERE seq > ? ORDER BY seq",
+                                 (self._last_seq,)).fetchall()
+        if rows:
+            self._last_seq = rows[-1][0]
+        changed = {name for seq, name in rows if seq not in self._own_seqs}
+        # 已经越过的序号不会再被查询到
+        self._own_seqs = {seq for seq in self._own_seqs if seq > self._last_seq}
+        return sorted(changed)
+
+    def import_directory(self, templates_dir, overwrite=False):
+        """从 .md 模板目录导入，返回导入的模板数量"""
+        count = 0
+        for name in list_template_names(templates_dir):
+            if not overwrite and self.exists(name):
+                continue
+            with open(os.path.join(templates_dir, f"{name}.md"), "r", encoding="utf-8") as f:
+                self.save(name, f.read())
+            count += 1
+        return count
+
+    def export_directory(self, templates_dir):
+        """导出为 .md 模板目录，返回导出的模板数量"""
+        os.makedirs(templates_dir, exist_ok=True)
+        count = 0
+        for name, content in self.conn.execute("SELECT name, content FROM templates ORDER BY name"):
+            with open(os.path.join(templates_dir, f"{name}.md"), "w", encoding="utf-8") as f:
+                f.write(content)
+            count += 1
+        return count
+
+    def close(self):
+        self.conn.close()